@@ -0,0 +1,384 @@
+import bisect
+import csv
+import math
+import os
+import statistics
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+AIRPORTS_CSV = "csv_files/airports.csv"
+# Compiled airport data, built from AIRPORTS_CSV on first use (see build_airports_data)
+AIRPORTS_DATA_DIR = os.getenv("AIRPORTS_DATA_DIR", "csv_files/airports_data")
+EARTH_RADIUS_KM = 6371.0088
+# Airports farther from the median of a city's airports are not in the city
+# (e.g. weather stations filed under it). Fewer airports than the minimum
+# (a lone airport can lie well outside the city) or a wider spread than the
+# maximum span give no city box at all, and the caller geocodes the city.
+CITY_BBOX_OUTLIER_KM = 40.0
+CITY_BBOX_MAX_SPAN_KM = 60.0
+CITY_BBOX_MIN_AIRPORTS = 2
+
+Airport = namedtuple("Airport", ["icao_code", "iata_code", "name", "city",
+                                 "country", "latitude", "longitude"])
+
+# One row per airport, sorted by country and city. Names, cities and
+# countries are indices in the string table, -1 for a missing name.
+AIRPORT_DTYPE = np.dtype([("icao_code", "S4"),
+                          ("iata_code", "S3"),
+                          ("name", "<i4"),
+                          ("city", "<i4"),
+                          ("country", "<i4"),
+                          ("latitude", "<f8"),
+                          ("longitude", "<f8")])
+DATA_FILES = ("airports.npy", "string_offsets.npy", "string_blob.npy")
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Compute the great-circle distance between two points.
+
+    Args:
+        lat1 (float): Latitude of the first point, in decimal degrees.
+        lon1 (float): Longitude of the first point, in decimal degrees.
+        lat2 (float): Latitude of the second point, in decimal degrees.
+        lon2 (float): Longitude of the second point, in decimal degrees.
+
+    Returns:
+        float: The distance between both points in kilometers.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (math.sin(d_phi / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class StringTable:
+    """
+    Sorted, interned strings stored as one UTF-8 blob and their offsets.
+
+    The table is a read-only sequence, so bisect finds the index of a string.
+
+    Args:
+        offsets (numpy.ndarray): Start of each string in the blob, followed by the blob length.
+        blob (numpy.ndarray): The concatenated UTF-8 strings, as uint8.
+    """
+
+    def __init__(self, offsets, blob):
+        # Memory views index without creating numpy scalars
+        self.offsets = memoryview(np.ascontiguousarray(offsets))
+        self.blob = memoryview(np.ascontiguousarray(blob))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode("utf-8")
+
+    def index(self, value):
+        """Return the index of a string, or -1 if it is not in the table."""
+        index = bisect.bisect_left(self, value)
+        return index if index < len(self) and self[index] == value else -1
+
+
+class AirportIndex:
+    """
+    Airport index over the compiled airport data, with lookups by country and
+    city and radius queries.
+
+    The rows are sorted by country and city, so both lookups are binary
+    searches, and the arrays can be memory-mapped: worker processes share
+    their pages instead of each holding a copy.
+
+    Airports without coordinates in the source database (stored as 0.0, 0.0)
+    are kept in the city lookup but left out of the radius queries.
+
+    Args:
+        records (numpy.ndarray): The airports, of AIRPORT_DTYPE.
+        strings (StringTable): The names, cities and countries referenced by the records.
+    """
+
+    def __init__(self, records, strings):
+        self.records = records
+        self.strings = strings
+        self._countries = None
+        self._cities_by_country = {}
+        self._radians = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def _airports(self, rows):
+        return [Airport(icao_code=icao_code.decode("ascii"),
+                        iata_code=iata_code.decode("ascii") or None,
+                        name=self.strings[name] if name >= 0 else None,
+                        city=self.strings[city],
+                        country=self.strings[country],
+                        latitude=latitude,
+                        longitude=longitude)
+                for icao_code, iata_code, name, city, country, latitude, longitude
+                in self.records[rows].tolist()]
+
+    def _country_rows(self, country_name):
+        country = self.strings.index(country_name.upper())
+        if country < 0:
+            return 0, 0
+        column = self.records["country"]
+        return (int(np.searchsorted(column, country, side="left")),
+                int(np.searchsorted(column, country, side="right")))
+
+    def countries(self):
+        """
+        Return the countries of the database.
+
+        Returns:
+            tuple: The country names, sorted.
+        """
+        if self._countries is None:
+            self._countries = tuple(self.strings[index] for index in np.unique(self.records["country"]))
+        return self._countries
+
+    def cities_in_country(self, country_name):
+        """
+        Return the cities of a country that have at least one airport.
+
+        Args:
+            country_name (str): The name of the country (case insensitive).
+
+        Returns:
+            tuple: The city names, sorted, empty if the country is unknown.
+        """
+        key = country_name.upper()
+        if key not in self._cities_by_country:
+            start, stop = self._country_rows(key)
+            self._cities_by_country[key] = tuple(
+                self.strings[index] for index in np.unique(self.records["city"][start:stop]))
+        return self._cities_by_country[key]
+
+    def airports_in_city(self, city_name, country_name):
+        """
+        Retrieve the airports registered for a city.
+
+        Args:
+            city_name (str): The name of the city (case insensitive).
+            country_name (str): The name of the country (case insensitive).
+
+        Returns:
+            tuple: The Airport records of the city, empty if it is unknown.
+        """
+        city = self.strings.index(city_name.upper())
+        if city < 0:
+            return ()
+        start, stop = self._country_rows(country_name)
+        cities = self.records["city"][start:stop]
+        first = start + int(np.searchsorted(cities, city, side="left"))
+        last = start + int(np.searchsorted(cities, city, side="right"))
+        return tuple(self._airports(slice(first, last)))
+
+    def city_bounding_box(self, city_name, country_name, padding_km=20.0,
+                          outlier_km=CITY_BBOX_OUTLIER_KM, max_span_km=CITY_BBOX_MAX_SPAN_KM,
+                          min_airports=CITY_BBOX_MIN_AIRPORTS):
+        """
+        Derive a bounding box for a city from the coordinates of its airports.
+
+        Args:
+            city_name (str): The name of the city (case insensitive).
+            country_name (str): The name of the country (case insensitive).
+            padding_km (float): Margin added around the airports, in kilometers.
+            outlier_km (float): Airports farther than this from the median of the
+                city's airports are left out, in kilometers.
+            max_span_km (float): Largest extent of the remaining airports, north to
+                south or west to east, in kilometers.
+            min_airports (int): Fewest remaining airports the box is derived from.
+
+        Returns:
+            tuple: (south, north, west, east) in decimal degrees, or None when
+            fewer than min_airports of the city's airports are located close
+            together or they spread wider than max_span_km.
+        """
+        airports = [airport for airport in self.airports_in_city(city_name, country_name)
+                    if has_coordinates(airport)]
+        if not airports:
+            return None
+        median_lat = statistics.median(airport.latitude for airport in airports)
+        median_lon = statistics.median(airport.longitude for airport in airports)
+        airports = [airport for airport in airports
+                    if haversine_km(median_lat, median_lon,
+                                    airport.latitude, airport.longitude) <= outlier_km]
+        if not airports or len(airports) < min_airports:
+            return None
+        south = min(airport.latitude for airport in airports)
+        north = max(airport.latitude for airport in airports)
+        west = min(airport.longitude for airport in airports)
+        east = max(airport.longitude for airport in airports)
+        middle = (south + north) / 2
+        if max(haversine_km(south, west, north, west),
+               haversine_km(middle, west, middle, east)) > max_span_km:
+            return None
+
+        lat_padding = math.degrees(padding_km / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(min(89.0, max(abs(south), abs(north)))))
+        lon_padding = min(180.0, lat_padding / cos_lat)
+        return (max(-90.0, south - lat_padding), min(90.0, north + lat_padding),
+                max(-180.0, west - lon_padding), min(180.0, east + lon_padding))
+
+    def airports_within(self, latitude, longitude, radius_km):
+        """
+        Retrieve the airports within a radius of a point, closest first.
+
+        Args:
+            latitude (float): Latitude of the center, in decimal degrees.
+            longitude (float): Longitude of the center, in decimal degrees.
+            radius_km (float): Search radius in kilometers.
+
+        Returns:
+            list: Tuples of (distance_km, Airport) sorted by distance.
+        """
+        if self._radians is None:
+            # Located airports by latitude, so the latitude band is a slice
+            located = np.flatnonzero((self.records["latitude"] != 0.0) | (self.records["longitude"] != 0.0))
+            located = located[np.argsort(self.records["latitude"][located], kind="stable")]
+            self._radians = (located, np.radians(self.records["latitude"][located]),
+                             np.radians(self.records["longitude"][located]))
+        located, phi2, lambda2 = self._radians
+
+        phi1, lambda1 = math.radians(latitude), math.radians(longitude)
+        # No airport farther in latitude than the radius can be within it
+        lat_span = radius_km / EARTH_RADIUS_KM
+        start, stop = np.searchsorted(phi2, (phi1 - lat_span, phi1 + lat_span))
+        located, phi2, lambda2 = located[start:stop], phi2[start:stop], lambda2[start:stop]
+        a = (np.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * np.cos(phi2) * np.sin((lambda2 - lambda1) / 2) ** 2)
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+        within = np.flatnonzero(distances <= radius_km)
+        within = within[np.argsort(distances[within], kind="stable")]
+        return list(zip(distances[within].tolist(), self._airports(located[within])))
+
+
+def has_coordinates(airport):
+    """Return True when the airport has a known (non 0.0, 0.0) position."""
+    return not (airport.latitude == 0.0 and airport.longitude == 0.0)
+
+
+def read_airports_csv(path=AIRPORTS_CSV):
+    """
+    Read the airports database into Airport records.
+
+    Args:
+        path (str): Path to the airports CSV file.
+
+    Returns:
+        list: The Airport records, in file order.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        return [
+            Airport(
+                icao_code=row["ICAO Code"],
+                iata_code=row["IATA Code"] or None,
+                name=row["Airport Name"] or None,
+                city=row["City/Town"],
+                country=row["Country"],
+                latitude=float(row["Latitude Decimal Degrees"]),
+                longitude=float(row["Longitude Decimal Degrees"]),
+            )
+            for row in csv.DictReader(file)
+        ]
+
+
+def compile_airports(airports):
+    """
+    Compile Airport records into the arrays of the airport index.
+
+    Args:
+        airports (iterable): The Airport records.
+
+    Returns:
+        tuple: (records, string offsets, string blob) arrays, see AirportIndex and StringTable.
+    """
+    airports = list(airports)
+    strings = sorted({value for airport in airports
+                      for value in (airport.name, airport.city, airport.country) if value})
+    string_ids = {value: index for index, value in enumerate(strings)}
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i4")
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    records = np.array([(airport.icao_code.encode("ascii"),
+                         (airport.iata_code or "").encode("ascii"),
+                         string_ids[airport.name] if airport.name else -1,
+                         string_ids[airport.city],
+                         string_ids[airport.country],
+                         airport.latitude,
+                         airport.longitude) for airport in airports], dtype=AIRPORT_DTYPE)
+    # Stable sort: the airports of a city keep their database order
+    records = records[np.lexsort((records["city"], records["country"]))]
+    return records, offsets, blob
+
+
+def build_airports_data(csv_path=AIRPORTS_CSV, data_dir=AIRPORTS_DATA_DIR):
+    """
+    Compile the airports CSV into the files memory-mapped by the airport index.
+
+    Args:
+        csv_path (str): Path to the airports CSV file.
+        data_dir (str): Folder receiving the compiled arrays (.npy files).
+
+    Returns:
+        str: The data folder.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    for file_name, array in zip(DATA_FILES, compile_airports(read_airports_csv(csv_path))):
+        # Written aside and renamed, so processes loading the data never see a partial file
+        temporary_path = os.path.join(data_dir, f".{file_name}.{os.getpid()}")
+        with open(temporary_path, "wb") as file:
+            np.save(file, array)
+        os.replace(temporary_path, os.path.join(data_dir, file_name))
+    return data_dir
+
+
+def load_airport_index(csv_path=AIRPORTS_CSV, data_dir=AIRPORTS_DATA_DIR):
+    """
+    Load the airport index from the compiled data, memory-mapped.
+
+    The data is compiled first when it is missing or older than the CSV.
+    When it cannot be written (e.g. read-only deployment), the index is
+    compiled in memory instead.
+
+    Args:
+        csv_path (str): Path to the airports CSV file.
+        data_dir (str): Folder of the compiled arrays.
+
+    Returns:
+        AirportIndex: The airport index.
+    """
+    paths = [os.path.join(data_dir, file_name) for file_name in DATA_FILES]
+    csv_mtime = os.path.getmtime(csv_path)
+    if not all(os.path.exists(path) and os.path.getmtime(path) >= csv_mtime for path in paths):
+        try:
+            build_airports_data(csv_path, data_dir)
+        except OSError:
+            records, offsets, blob = compile_airports(read_airports_csv(csv_path))
+            return AirportIndex(records, StringTable(offsets, blob))
+    # Plain views of the mapped files: same pages, without the memmap indexing overhead
+    records, offsets, blob = (np.asarray(np.load(path, mmap_mode="r")) for path in paths)
+    return AirportIndex(records, StringTable(offsets, blob))
+
+
+@lru_cache(maxsize=None)
+def get_airport_index():
+    """
+    Return the process-wide airport index, loading it on first use.
+
+    Returns:
+        AirportIndex: The shared airport index.
+    """
+    return load_airport_index()
+
+
+if __name__ == "__main__":
+    # Build step, e.g. in the image: python airports.py
+    print(f"Airport data compiled to {build_airports_data()}")
@@ -0,0 +1,249 @@
+"""
+Headless batch planning: run the travel plans of many trips without the app.
+
+Trips are read from a CSV or JSONL file and planned by a pool of workers
+with the same task chains, caches and API clients as the app. Finished
+plans are appended to a JSONL checkpoint, so an interrupted batch resumes
+where it stopped when run again with the same output file. Plans are also
+saved to the jobs store, so the app serves identical trips right away.
+
+Columns (CSV) or keys (JSONL): city, country (in any case), arrival_date, departure_date
+(YYYY-MM-DD), dining_options (separated with ";" in CSV) and optionally
+guests, rooms, kids, children_age, travel_purpose, additional_considerations.
+
+Usage:
+    python batch.py trips.csv --output plans.jsonl --workers 4
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import date
+
+from caching import SQLiteCache
+from jobs import (JobManager, plan_job_id, DONE, FAILED, JOBS_DB_PATH, JOB_RESULTS_TTL_SECONDS,
+                  PLAN_WORKERS)
+from planner import build_llm_config
+
+BATCH_POLL_INTERVAL_SECONDS = 0.5
+
+# Short column names accepted for the fields of the app form
+FIELD_ALIASES = {"city": "city_name",
+                 "country": "country_option",
+                 "guests": "number_of_guests",
+                 "rooms": "number_of_rooms",
+                 "kids": "number_of_kids"}
+REQUIRED_FIELDS = ("city_name", "country_option", "arrival_date", "departure_date", "dining_options")
+# Defaults of the app form
+TRIP_DEFAULTS = {"number_of_kids": 0,
+                 "children_age": "",
+                 "number_of_guests": 1,
+                 "number_of_rooms": 1,
+                 "travel_purpose": "leisure",
+                 "additional_considerations": ""}
+
+
+def parse_trip(record):
+    """
+    Build a trip, as the app form would, from a row of the batch file.
+
+    Args:
+        record (dict): The row, with the field names of the app or their aliases.
+
+    Returns:
+        dict: The trip details.
+
+    Raises:
+        ValueError: If a required field is missing or a value is invalid.
+    """
+    trip = dict(TRIP_DEFAULTS)
+    for key, value in record.items():
+        key = key.strip()
+        if value not in (None, ""):
+            trip[FIELD_ALIASES.get(key, key)] = value
+    missing = [field for field in REQUIRED_FIELDS if field not in trip]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    # Named as in the app's selectors (csv_files/airports.csv), so trips get the app's job ids
+    for field in ("city_name", "country_option"):
+        trip[field] = str(trip[field]).strip().upper()
+    for field in ("number_of_kids", "number_of_guests", "number_of_rooms"):
+        trip[field] = int(trip[field])
+    for field in ("arrival_date", "departure_date"):
+        if not isinstance(trip[field], date):
+            trip[field] = date.fromisoformat(str(trip[field]).strip())
+    if trip["departure_date"] < trip["arrival_date"]:
+        raise ValueError("departure_date is before arrival_date")
+    if isinstance(trip["dining_options"], str):
+        trip["dining_options"] = [option.strip() for option in trip["dining_options"].split(";")
+                                  if option.strip()]
+    trip["children_age"] = str(trip["children_age"])
+    return trip
+
+
+def read_trips(path):
+    """
+    Read the trips of a CSV or JSONL batch file.
+
+    Args:
+        path (str): The file, read as JSONL when its name ends with .jsonl.
+
+    Returns:
+        list: The trips, in file order.
+
+    Raises:
+        ValueError: If a row is not a valid trip, with its line number.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            rows = [(number, json.loads(line)) for number, line in enumerate(file, start=1)
+                    if line.strip()]
+        else:
+            rows = list(enumerate(csv.DictReader(file), start=2))
+
+    trips = []
+    for number, row in rows:
+        try:
+            trips.append(parse_trip(row))
+        except (ValueError, TypeError) as error:
+            raise ValueError(f"{path}:{number}: {error}") from error
+    return trips
+
+
+def load_checkpoint(path):
+    """
+    Return the identifiers of the plans already finished in a checkpoint.
+
+    Args:
+        path (str): The JSONL output of a previous batch, if any.
+
+    Returns:
+        set: The job identifiers of the finished plans (failed ones are retried).
+    """
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Line cut by an interruption
+                continue
+            if record.get("status") == DONE:
+                done.add(record["job_id"])
+    return done
+
+
+def plan_record(trip, snapshot):
+    """
+    Build the checkpoint line of a finished plan.
+
+    Args:
+        trip (dict): The trip details.
+        snapshot (dict): The job snapshot (see jobs.Job.snapshot).
+
+    Returns:
+        dict: Job id, status, error, trip and the text and summary compaction
+        report of each step.
+    """
+    return {"job_id": snapshot["job_id"],
+            "status": snapshot["status"],
+            "error": snapshot["error"],
+            "finished_at": snapshot["finished_at"],
+            "trip": trip,
+            "steps": {name: {"status": step["status"], "message": step["message"],
+                             "error": step.get("error"), "compaction": step.get("compaction")}
+                      for name, step in snapshot["steps"].items()}}
+
+
+def run_batch(trips, output_path, job_manager, workers=PLAN_WORKERS,
+              poll_interval=BATCH_POLL_INTERVAL_SECONDS):
+    """
+    Plan the trips not finished yet, keeping up to `workers` plans on their way.
+
+    Args:
+        trips (list): The trips, as returned by read_trips.
+        output_path (str): The JSONL checkpoint, appended to as plans finish.
+        job_manager (JobManager): The job manager running the plans.
+        workers (int): Number of plans submitted at the same time.
+        poll_interval (float): Seconds between two checks of the running plans.
+
+    Returns:
+        dict: Number of trips, plans done, failed and skipped (already in the
+        checkpoint or duplicated), elapsed seconds and plans per minute.
+    """
+    finished = load_checkpoint(output_path)
+    pending = {}
+    for trip in trips:
+        pending.setdefault(plan_job_id(trip), trip)
+    skipped = len(trips) - len(pending)
+    for job_id in finished & set(pending):
+        del pending[job_id]
+        skipped += 1
+
+    pending = list(pending.items())
+    running = {}
+    done = failed = 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as output:
+        while pending or running:
+            while pending and len(running) < workers:
+                job_id, trip = pending.pop(0)
+                # One user per plan: the per-user limit and run cleanup are per plan
+                job_manager.submit(f"batch-{job_id}", trip)
+                running[job_id] = trip
+            time.sleep(poll_interval)
+            for job_id, trip in list(running.items()):
+                snapshot = job_manager.get(job_id)
+                if snapshot is not None and snapshot["status"] not in (DONE, FAILED):
+                    continue
+                if snapshot is None:
+                    snapshot = {"job_id": job_id, "status": FAILED, "error": "The plan result expired.",
+                                "finished_at": time.time(), "steps": {}}
+                del running[job_id]
+                output.write(json.dumps(plan_record(trip, snapshot), default=str) + "\n")
+                output.flush()
+                if snapshot["status"] == DONE:
+                    done += 1
+                else:
+                    failed += 1
+                elapsed = time.perf_counter() - start
+                print(f"[{done + failed + skipped}/{len(trips)}] {job_id} {snapshot['status']} "
+                      f"({trip['city_name']}, {trip['country_option']}) "
+                      f"{60.0 * done / elapsed:.2f} plans/min", flush=True)
+
+    elapsed = time.perf_counter() - start
+    return {"trips": len(trips),
+            "done": done,
+            "failed": failed,
+            "skipped": skipped,
+            "elapsed_s": round(elapsed, 3),
+            "plans_per_minute": round(60.0 * done / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("trips", help="CSV or JSONL file of trips.")
+    parser.add_argument("--output", default="plans.jsonl",
+                        help="JSONL checkpoint of the finished plans; an existing one is resumed.")
+    parser.add_argument("--workers", type=int, default=PLAN_WORKERS, help="Plans running at the same time.")
+    parser.add_argument("--jobs-db", default=JOBS_DB_PATH,
+                        help="Jobs store shared with the app (JOBS_DB_PATH).")
+    args = parser.parse_args(argv)
+
+    trips = read_trips(args.trips)
+    job_manager = JobManager(SQLiteCache(args.jobs_db, ttl=JOB_RESULTS_TTL_SECONDS),
+                             max_workers=args.workers,
+                             llm_config=build_llm_config(stream=False))
+    report = run_batch(trips, args.output, job_manager, workers=args.workers)
+    print(f"{report['done']} plans done, {report['failed']} failed, {report['skipped']} skipped "
+          f"in {report['elapsed_s']:.1f} s ({report['plans_per_minute']:.2f} plans/min)")
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Local stand-ins for the services used by the travel planner: the OpenAI chat
+completions API, the Booking list-by-map endpoint, Tavily search and
+Nominatim. All routes are served by one threaded HTTP server, answer from the
+recorded fixtures in benchmarks/fixtures and can be slowed down with an
+injected latency per service.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Services of the mock server, used as keys of the latency and counter dictionaries
+SERVICES = ("openai", "booking", "tavily", "nominatim")
+
+RESULT_HANDLE = re.compile(r"hotels-[0-9a-f]{12}")
+SPEAKER_LIST = re.compile(r"select the next role from \[(.*?)\]")
+HOTELS_TASK = re.compile(r"list of\s+hotels")
+BBOX_SEPARATOR = re.compile(r"%2C|,")
+# Hotels per list-by-map page, as the Booking API pages its results
+BOOKING_PAGE_SIZE = 10
+
+
+def load_fixture(name):
+    """
+    Load a recorded response from benchmarks/fixtures.
+
+    Args:
+        name (str): The fixture file name.
+
+    Returns:
+        The decoded JSON fixture.
+    """
+    with open(os.path.join(FIXTURES_DIR, name), "r") as file:
+        return json.load(file)
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class ScriptedChatModel:
+    """
+    Deterministic replacement for the chat model.
+
+    It calls the tool a task asks for (once per conversation), picks the
+    first candidate when asked to select the next speaker, approves as the
+    critic, and otherwise answers with the last tool result followed by
+    TERMINATE.
+
+    Args:
+        trip (dict): The trip of the benchmark, used as tool arguments.
+    """
+
+    def __init__(self, trip):
+        self.trip = trip
+
+    def reply(self, request):
+        """
+        Build the assistant message answering a chat completions request.
+
+        Args:
+            request (dict): The chat completions request body.
+
+        Returns:
+            dict: The assistant message (content or tool_calls).
+        """
+        messages = request.get("messages", [])
+        text = "\n".join(str(message.get("content") or "") for message in messages)
+        tool_names = {tool["function"]["name"] for tool in request.get("tools") or []}
+        has_tool_result = any(message.get("role") in ("tool", "function") for message in messages)
+
+        speakers = SPEAKER_LIST.findall(text)
+        if speakers:
+            candidates = [name.strip(" '\"") for name in speakers[-1].split(",")]
+            return {"role": "assistant", "content": candidates[0]}
+
+        system_message = str(messages[0].get("content") or "") if messages else ""
+        if system_message.startswith("Evaluate the execution results"):
+            return {"role": "assistant", "content": "All answers are YES. TASK_COMPLETED"}
+
+        task = next((str(message.get("content") or "") for message in messages
+                     if message.get("role") == "user"), "")
+        if not has_tool_result:
+            tool_call = self._tool_call_for(task, text, tool_names)
+            if tool_call is not None:
+                return {"role": "assistant", "content": None, "tool_calls": [tool_call]}
+
+        tool_results = [str(message.get("content") or "") for message in messages
+                        if message.get("role") in ("tool", "function")]
+        body = tool_results[-1][:2000] if tool_results else task[:500]
+        return {"role": "assistant",
+                "content": f"# Here is the requested content:\n\n{body}\n\nTERMINATE"}
+
+    def _tool_call_for(self, task, text, tool_names):
+        trip = self.trip
+        if "search_tavily_batch" in tool_names and "search_tavily_batch" in task:
+            topic = f"{task.splitlines()[0][:120]} {trip['city_name']}"
+            arguments = {"queries": [topic] + [f"{option} {trip['city_name']}"
+                                               for option in trip["dining_options"]]}
+            name = "search_tavily_batch"
+        elif "search_tavily" in tool_names and "search_tavily" in task:
+            arguments = {"query": f"{task.splitlines()[0][:120]} {trip['city_name']}"}
+            name = "search_tavily"
+        elif "plot_hotels_on_map" in tool_names and "plot_hotels_on_map" in task:
+            handles = RESULT_HANDLE.findall(text)
+            arguments = {"city_name": trip["city_name"], "country_name": trip["country_option"],
+                         "result_handle": handles[-1] if handles else ""}
+            name = "plot_hotels_on_map"
+        elif "get_list_of_locations" in tool_names and HOTELS_TASK.search(task):
+            arguments = {"city_name": trip["city_name"], "country_name": trip["country_option"],
+                         "travel_purpose": trip["travel_purpose"],
+                         "arrival_date": str(trip["arrival_date"]),
+                         "departure_date": str(trip["departure_date"]),
+                         "children_qty": trip["number_of_kids"],
+                         "children_age": trip["children_age"],
+                         "guest_qty": trip["number_of_guests"],
+                         "room_qty": trip["number_of_rooms"]}
+            name = "get_list_of_locations"
+        else:
+            return None
+        return {"id": f"call_{name}_{int(time.time() * 1e6)}", "type": "function",
+                "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+
+class MockServices:
+    """
+    Threaded HTTP server answering as OpenAI, Booking, Tavily and Nominatim.
+
+    Args:
+        trip (dict): The trip of the benchmark, used by the scripted chat model.
+        latency (dict): Seconds added before answering, per service.
+        token_delay (float): Seconds between two streamed chat completion chunks.
+        port (int): Port to listen on, 0 picks a free one.
+    """
+
+    def __init__(self, trip, latency=None, token_delay=0.0, port=0):
+        self.model = ScriptedChatModel(trip)
+        self.latency = dict.fromkeys(SERVICES, 0.0)
+        self.latency.update(latency or {})
+        self.token_delay = token_delay
+        self.requests = Counter()
+        self.tokens = Counter()
+        self._lock = threading.Lock()
+        self._fixtures = {"booking": load_fixture("booking_list_by_map.json"),
+                          "tavily": load_fixture("tavily_search.json"),
+                          "nominatim": load_fixture("nominatim_search.json")}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """
+        Return the environment variables pointing the app to this server.
+
+        Returns:
+            dict: Environment variables to set before importing the app modules.
+        """
+        return {"OPENAI_BASE_URL": f"{self.base_url}/v1",
+                "OPENAI_API_KEY": "sk-benchmark",
+                "BOOKING_API_BASE_URL": self.base_url,
+                "RAPID_API_KEY": "benchmark",
+                "TAVILY_BASE_URL": self.base_url,
+                "TAVILY_API_KEY": "tvly-benchmark",
+                "NOMINATIM_DOMAIN": self.base_url[len("http://"):],
+                "NOMINATIM_SCHEME": "http"}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="mock-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count(self, service, prompt_tokens=0, completion_tokens=0):
+        with self._lock:
+            self.requests[service] += 1
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["completion"] += completion_tokens
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/properties/list-by-map":
+                    self._list_by_map(parse_qs(urlparse(self.path).query))
+                elif path == "/search":
+                    self._fixture("nominatim")
+                else:
+                    self._send_json(404, {"error": f"unknown route {path}"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = urlparse(self.path).path
+                if path == "/v1/chat/completions":
+                    self._chat_completion(body)
+                elif path == "/search":
+                    self._fixture("tavily", query=body.get("query", ""))
+                else:
+                    self._send_json(404, {"error": f"unknown route {path}"})
+
+            def _fixture(self, service, query=None):
+                time.sleep(services.latency[service])
+                services._count(service)
+                payload = services._fixtures[service]
+                if query is not None:
+                    payload = dict(payload, query=query)
+                self._send_json(200, payload)
+
+            def _list_by_map(self, query):
+                time.sleep(services.latency["booking"])
+                services._count("booking")
+                hotels = services._fixtures["booking"]["result"]
+                if "bbox" in query:
+                    south, north, west, east = map(float, BBOX_SEPARATOR.split(query["bbox"][0]))
+                    hotels = [hotel for hotel in hotels
+                              if south <= hotel["latitude"] <= north and west <= hotel["longitude"] <= east]
+                offset = int(query.get("offset", ["0"])[0])
+                self._send_json(200, {"count": len(hotels),
+                                      "result": hotels[offset:offset + BOOKING_PAGE_SIZE]})
+
+            def _chat_completion(self, body):
+                time.sleep(services.latency["openai"])
+                message = services.model.reply(body)
+                prompt_tokens = estimate_tokens(json.dumps(body.get("messages", [])))
+                completion_tokens = estimate_tokens(json.dumps(message))
+                services._count("openai", prompt_tokens, completion_tokens)
+                created = int(time.time())
+                if body.get("stream"):
+                    self._stream_chat_completion(body, message, created)
+                    return
+                self._send_json(200, {
+                    "id": f"chatcmpl-{created}", "object": "chat.completion",
+                    "created": created, "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "message": message,
+                                 "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens,
+                              "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens}})
+
+            def _stream_chat_completion(self, body, message, created):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(data):
+                    event = f"data: {data}\n\n".encode()
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                    self.wfile.flush()
+
+                def chunk(delta, finish_reason=None):
+                    send(json.dumps({"id": f"chatcmpl-{created}", "object": "chat.completion.chunk",
+                                     "created": created, "model": body.get("model", "mock"),
+                                     "choices": [{"index": 0, "delta": delta,
+                                                  "finish_reason": finish_reason}]}))
+
+                if message.get("tool_calls"):
+                    tool_calls = [dict(call, index=index)
+                                  for index, call in enumerate(message["tool_calls"])]
+                    chunk({"role": "assistant", "content": None, "tool_calls": tool_calls})
+                    chunk({}, "tool_calls")
+                else:
+                    for word in re.findall(r"\S+\s*", message["content"]):
+                        chunk({"role": "assistant", "content": word})
+                        time.sleep(services.token_delay)
+                    chunk({}, "stop")
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,222 @@
+"""
+End-to-end benchmark of the three-step travel plan, run offline against the
+local stand-ins of benchmarks/mock_services.py.
+
+The plan is built with the same planner functions as app.py and run
+headlessly. The report gives, per step, the wall time, the LLM tokens used
+by the agents and the number of tool calls, and for the whole run the
+requests served per service, the peak memory and the per-endpoint latency
+histograms.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmark.py --runs 3 --latency openai=0.2,booking=0.5
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_services import MockServices, SERVICES  # noqa: E402
+
+STEPS = ("hotels", "places", "dining")
+
+
+def parse_latency(value):
+    """
+    Parse a latency specification such as "openai=0.2,booking=0.5".
+
+    Args:
+        value (str): Comma separated service=seconds pairs.
+
+    Returns:
+        dict: Seconds per service.
+    """
+    latency = {}
+    for item in filter(None, value.split(",")):
+        service, seconds = item.split("=")
+        if service not in SERVICES:
+            raise argparse.ArgumentTypeError(f"unknown service '{service}', expected one of {SERVICES}")
+        latency[service] = float(seconds)
+    return latency
+
+
+def build_trip(args):
+    """
+    Build the trip submitted by the benchmark, as the app form would.
+
+    Args:
+        args (argparse.Namespace): The command line arguments.
+
+    Returns:
+        dict: The trip details.
+    """
+    arrival_date = date.today() + timedelta(days=30)
+    return {'city_name': args.city,
+            'country_option': args.country,
+            'arrival_date': arrival_date,
+            'departure_date': arrival_date + timedelta(days=3),
+            'number_of_kids': 0,
+            'children_age': '',
+            'number_of_guests': 2,
+            'number_of_rooms': 1,
+            'travel_purpose': 'leisure',
+            'additional_considerations': 'Visiting the city for the first time',
+            'dining_options': ['Traditional cuisine from the city', 'Vegan']}
+
+
+def count_tokens(agents):
+    """
+    Sum the LLM tokens used by agents, cached completions included.
+
+    Args:
+        agents (list): The agents of a chain.
+
+    Returns:
+        dict: Prompt, completion and total tokens.
+    """
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for agent in agents:
+        usage = agent.client.total_usage_summary if agent.client is not None else None
+        for model, model_usage in (usage or {}).items():
+            if model == "total_cost":
+                continue
+            for key in tokens:
+                tokens[key] += model_usage.get(key, 0)
+    return tokens
+
+
+def count_tool_calls(chain, chat_results):
+    """
+    Count the tool calls made by the agents of a chain.
+
+    Args:
+        chain (dict): The task chain.
+        chat_results (list): The ChatResult of each chat of the chain.
+
+    Returns:
+        int: The number of tool calls.
+    """
+    messages = [message for chat_result in chat_results for message in chat_result.chat_history]
+    if "manager_agent" in chain:
+        messages += chain["manager_agent"].groupchat.messages
+    return sum(len(message.get("tool_calls") or []) for message in messages)
+
+
+def run_plan(trip, llm_config, planner, utils, hotels_mode="direct"):
+    """
+    Run the three steps of a plan concurrently, as app.py does.
+
+    Returns:
+        dict: Per-step wall time, tokens and tool calls.
+    """
+    build_hotels_chain = (planner.build_hotels_direct_chain if hotels_mode == "direct"
+                          else planner.build_hotels_chain)
+    chains = {"hotels": build_hotels_chain(trip, llm_config),
+              "places": planner.build_places_chain(trip, llm_config),
+              "dining": planner.build_dining_chain(trip, llm_config)}
+    for chain in chains.values():
+        chain["output_stream"] = utils.ChainOutputStream()
+
+    steps = {}
+    start = time.perf_counter()
+    for name, message_task, (chat_results, _) in utils.run_task_chains_concurrently(chains):
+        chain = chains[name]
+        steps[name] = {"wall_time_s": round(time.perf_counter() - start, 3),
+                       "tool_calls": count_tool_calls(chain, chat_results),
+                       "summary_chars": len(message_task or ""),
+                       **count_tokens(planner.chain_agents(chain))}
+        planner.teardown_chain(chain)
+    steps["plan"] = {"wall_time_s": round(time.perf_counter() - start, 3)}
+    return steps
+
+
+def print_report(report):
+    print(f"{'run':>4} {'step':<8} {'wall (s)':>9} {'tokens':>8} {'tool calls':>11}")
+    for index, run in enumerate(report["runs"], start=1):
+        for step in STEPS + ("plan",):
+            values = run[step]
+            print(f"{index:>4} {step:<8} {values['wall_time_s']:>9.3f} "
+                  f"{values.get('total_tokens', ''):>8} {values.get('tool_calls', ''):>11}")
+    print(f"requests served: {report['requests']}")
+    print(f"mock tokens served: {report['mock_tokens']}")
+    print(f"summary compaction: {report['summary_compaction']}")
+    print(f"agent pool: {report['agent_pool']}")
+    print(f"peak traced memory: {report['peak_traced_memory_mb']:.1f} MB, "
+          f"max RSS: {report['max_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=1, help="Number of plans to run one after another.")
+    parser.add_argument("--city", default="Madrid")
+    parser.add_argument("--country", default="Spain")
+    parser.add_argument("--latency", type=parse_latency, default={},
+                        help="Injected latency per service, e.g. openai=0.2,booking=0.5")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="Seconds between streamed tokens (with --stream).")
+    parser.add_argument("--hotels-mode", choices=("direct", "agents"), default="direct",
+                        help="Run Step 1 tools directly or through the agents (HOTELS_EXECUTION_MODE).")
+    parser.add_argument("--speaker-selection", choices=("rules", "round_robin", "small_model", "auto"),
+                        default="rules", help="Speaker selection of the critic GroupChats (SPEAKER_SELECTION).")
+    parser.add_argument("--stream", action="store_true", help="Stream agent replies, as the app does.")
+    parser.add_argument("--keep-caches", action="store_true",
+                        help="Use the configured cache paths instead of empty temporary ones.")
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    trip = build_trip(args)
+    with MockServices(trip, latency=args.latency, token_delay=args.token_delay) as services, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        os.environ.update(services.environment())
+        os.environ["SPEAKER_SELECTION"] = args.speaker_selection
+        # The timing table is built from the spans
+        os.environ.setdefault("TRACING_ENABLED", "true")
+        if not args.keep_caches:
+            os.environ["LLM_CACHE_PATH"] = os.path.join(cache_dir, "llm_responses.sqlite")
+            os.environ["GEOCODE_CACHE_PATH"] = os.path.join(cache_dir, "geocode.sqlite")
+            os.environ["TRACES_PATH"] = os.path.join(cache_dir, "traces.jsonl")
+        # The app reads its relative paths (conf/, csv_files/) from the repository root
+        os.chdir(ROOT_DIR)
+
+        # Imported once the environment points to the mock services
+        import planner
+        import utils
+        from clients import latency_report
+        from compaction import compaction_report
+        from tracing import timing_table, format_timing_table
+
+        llm_config = planner.build_llm_config(stream=args.stream)
+        tracemalloc.start()
+        runs = [run_plan(trip, llm_config, planner, utils, args.hotels_mode)
+                for _ in range(args.runs)]
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        report = {"runs": runs,
+                  "requests": dict(services.requests),
+                  "mock_tokens": dict(services.tokens),
+                  "peak_traced_memory_mb": peak / 2 ** 20,
+                  "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "summary_compaction": compaction_report(),
+                  "agent_pool": planner.get_agent_pool().stats(),
+                  "timings": timing_table(),
+                  "latency": latency_report()}
+
+    print_report(report)
+    print(format_timing_table(report["timings"]))
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump(report, file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+
+from tracing import record_cache_lookup
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 512))
+LLM_CACHE_MEMORY_BYTES = int(os.getenv("LLM_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+# Rows kept per SQLite store; the oldest writes are evicted beyond it
+SQLITE_CACHE_MAX_ROWS = int(os.getenv("SQLITE_CACHE_MAX_ROWS", 100000))
+# Writes between two purges of the expired and extra rows of a SQLite store
+SQLITE_CACHE_PURGE_EVERY = 1000
+
+
+def make_key(*parts):
+    """
+    Build a content-addressed cache key.
+
+    Args:
+        *parts: JSON-serializable values identifying the cached item.
+
+    Returns:
+        str: The SHA-256 hex digest of the parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _CacheBase:
+    """
+    Shared bookkeeping of the caches below.
+
+    The caches follow autogen's AbstractCache protocol, so they can be given
+    as the `cache` argument of a chat. autogen enters and exits the cache
+    around every completion, therefore leaving the context does not close
+    it: shared caches are closed explicitly with close().
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Lookups are counted on the current span, except those of the tiers
+        # of a TieredCache, which counts each lookup once
+        self.traced = True
+
+    def _record(self, hit):
+        if self.traced:
+            record_cache_lookup(hit)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self):
+        """
+        Return the hit/miss counters of the cache.
+
+        Returns:
+            dict: The number of hits and misses, and the hit ratio.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+class TTLCache(_CacheBase):
+    """
+    Thread-safe in-memory LRU cache with time-to-live and size-based eviction.
+
+    Args:
+        maxsize (int): Maximum number of entries.
+        ttl (float): Seconds an entry stays valid. None keeps entries until evicted.
+        max_bytes (int): Maximum total size of the entries, measured with their
+            pickled length. None disables size accounting.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._size = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, record=False) is not _MISSING
+
+    def get(self, key, default=None, record=True):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                self._pop(key)
+                entry = None
+            if record:
+                self._record(entry is not None)
+            if entry is None:
+                return default
+            self._data.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value):
+        size = len(pickle.dumps(value)) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (expires_at, size, value)
+            self._size += size
+            while (len(self._data) > self.maxsize
+                   or (self.max_bytes is not None and self._size > self.max_bytes)):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def _pop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._size -= size
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"entries": len(self._data), "bytes": self._size,
+                      "evictions": self.evictions})
+        return stats
+
+
+class SQLiteCache(_CacheBase):
+    """
+    Persistent cache stored in a SQLite database, with values pickled.
+
+    Expired entries, and the oldest writes beyond max_rows, are purged when
+    the store opens and every SQLITE_CACHE_PURGE_EVERY writes.
+
+    Args:
+        path (str): Path to the database file. Parent folders are created if needed.
+        ttl (float): Seconds an entry stays valid. None keeps entries until evicted.
+        max_rows (int): Maximum number of entries. None disables the limit.
+    """
+
+    def __init__(self, path, ttl=None, max_rows=SQLITE_CACHE_MAX_ROWS):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.evictions = 0
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)")
+        self.purge()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= time.time():
+                with self._connection:
+                    self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                row = None
+            self._record(row is not None)
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        payload = pickle.dumps(value)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, expires_at))
+            self._writes += 1
+            purge = self._writes % SQLITE_CACHE_PURGE_EVERY == 0
+        if purge:
+            self.purge()
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        """
+        Delete the expired entries.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),))
+            return cursor.rowcount
+
+    def purge(self):
+        """
+        Delete the expired entries, then the oldest writes beyond max_rows.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        deleted = self.purge_expired()
+        if self.max_rows is None:
+            return deleted
+        with self._lock, self._connection:
+            # REPLACE gives a rewritten entry a new rowid, so rowids follow write order
+            cursor = self._connection.execute(
+                "DELETE FROM cache WHERE rowid IN "
+                "(SELECT rowid FROM cache ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,))
+            self.evictions += cursor.rowcount
+        return deleted + cursor.rowcount
+
+    def stats(self):
+        stats = super().stats()
+        stats["evictions"] = self.evictions
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class TieredCache(_CacheBase):
+    """
+    Cache made of a fast front (usually a TTLCache) over a persistent back
+    (usually a SQLiteCache). Back hits are promoted to the front.
+
+    Args:
+        front: The in-memory cache.
+        back: The persistent cache.
+    """
+
+    def __init__(self, front, back):
+        super().__init__()
+        self.front = front
+        self.back = back
+        self.front.traced = self.back.traced = False
+
+    def get(self, key, default=None):
+        value = self.front.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.back.get(key, _MISSING)
+            if value is not _MISSING:
+                self.front.set(key, value)
+        self._record(value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        self.front.set(key, value)
+        self.back.set(key, value)
+
+    def delete(self, key):
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"front": self.front.stats(), "back": self.back.stats()})
+        return stats
+
+    def close(self):
+        self.front.close()
+        self.back.close()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing a key into a single execution.
+
+    The first caller of a key runs the function; callers arriving while it
+    is in flight wait for, and share, its result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs) unless a call with the same key is in flight.
+
+        Args:
+            key (str): The key identifying identical calls.
+            function (callable): The function to run.
+
+        Returns:
+            The result of the function.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+_MISSING = object()
+
+
+@lru_cache(maxsize=None)
+def get_llm_cache():
+    """
+    Return the process-wide LLM response cache, shared by the agents and the summary call.
+
+    Returns:
+        TieredCache: An in-memory LRU front over the SQLite store at LLM_CACHE_PATH.
+    """
+    return TieredCache(TTLCache(maxsize=LLM_CACHE_MEMORY_ITEMS,
+                                ttl=LLM_CACHE_TTL_SECONDS,
+                                max_bytes=LLM_CACHE_MEMORY_BYTES),
+                       SQLiteCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL_SECONDS))
@@ -0,0 +1,297 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from geopy.adapters import RequestsAdapter
+from geopy.geocoders import Nominatim
+from openai import OpenAI, AsyncOpenAI
+from tavily import TavilyClient
+from tavily.errors import UsageLimitExceededError, InvalidAPIKeyError
+
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", 60))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 600))
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME", "https")
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_async_openai_clients = {}
+_async_openai_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with fixed buckets (see LATENCY_BUCKETS_MS).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+
+    def observe(self, seconds):
+        milliseconds = seconds * 1000.0
+        with self._lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, milliseconds)] += 1
+            self.count += 1
+            self.total_ms += milliseconds
+            self.min_ms = milliseconds if self.min_ms is None else min(self.min_ms, milliseconds)
+            self.max_ms = milliseconds if self.max_ms is None else max(self.max_ms, milliseconds)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket that contains it.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimated latency in milliseconds, or None without observations.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(LATENCY_BUCKETS_MS + (self.max_ms,), self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def snapshot(self):
+        """
+        Return the histogram as a plain dictionary.
+
+        Returns:
+            dict: Count, mean/min/max/p50/p95 in milliseconds and the bucket counts.
+        """
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        with self._lock:
+            buckets = {f"<={bound}ms": count
+                       for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)}
+            buckets[f">{LATENCY_BUCKETS_MS[-1]}ms"] = self.counts[-1]
+            return {"count": self.count,
+                    "mean_ms": self.total_ms / self.count if self.count else None,
+                    "min_ms": self.min_ms,
+                    "max_ms": self.max_ms,
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "buckets": buckets}
+
+
+def record_latency(endpoint, seconds):
+    """
+    Record the duration of a call in the histogram of its endpoint.
+
+    Args:
+        endpoint (str): The endpoint name, e.g. "booking GET /properties/list-by-map".
+        seconds (float): The duration of the call.
+    """
+    with _histograms_lock:
+        histogram = _histograms.get(endpoint)
+        if histogram is None:
+            histogram = _histograms[endpoint] = LatencyHistogram()
+    histogram.observe(seconds)
+
+
+@contextmanager
+def timed(endpoint):
+    """Record the duration of the enclosed block in the histogram of an endpoint."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_latency(endpoint, time.perf_counter() - start)
+
+
+def latency_report():
+    """
+    Return the latency histograms of every endpoint called so far.
+
+    Returns:
+        dict: Mapping of endpoint name to LatencyHistogram.snapshot().
+    """
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    return {endpoint: histogram.snapshot() for endpoint, histogram in sorted(histograms.items())}
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session applying default timeouts and recording per-endpoint latency.
+
+    Args:
+        name (str): The name of the service, used as the endpoint prefix.
+    """
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS))
+        with timed(f"{self.name} {method.upper()} {urlparse(url).path or '/'}"):
+            return super().request(method, url, *args, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_http_session(name):
+    """
+    Return the shared keep-alive session of a service.
+
+    Connections are pooled (up to HTTP_POOL_MAXSIZE per host), and idempotent
+    requests are retried with exponential backoff on connection errors and
+    on 429/5xx responses.
+
+    Args:
+        name (str): The name of the service, e.g. "booking".
+
+    Returns:
+        PooledSession: The session of the service.
+    """
+    retry = Retry(total=HTTP_MAX_RETRIES,
+                  backoff_factor=HTTP_BACKOFF_FACTOR,
+                  status_forcelist=RETRY_STATUS_CODES,
+                  allowed_methods=frozenset({"GET", "POST"}),
+                  respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = PooledSession(name)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class PooledTavilyClient(TavilyClient):
+    """
+    TavilyClient sending its searches through a shared PooledSession
+    instead of a new connection per call.
+
+    tavily-python has no public seam for the HTTP call: its private _search
+    posts with requests.post directly. _search is mirrored here, with the
+    same arguments and errors, for the exact version pinned in
+    requirements.txt; check it again when upgrading tavily-python.
+    """
+
+    def __init__(self, api_key=None, session=None):
+        super().__init__(api_key=api_key)
+        self.base_url = f"{TAVILY_BASE_URL}/search"
+        self.session = session or get_http_session("tavily")
+
+    def _search(self, query, search_depth="basic", topic="general", days=3, max_results=5,
+                include_domains=None, exclude_domains=None, include_answer=False,
+                include_raw_content=False, include_images=False, use_cache=True):
+        data = {
+            "query": query,
+            "search_depth": search_depth,
+            "topic": topic,
+            "days": days,
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+            "max_results": max_results,
+            "include_domains": include_domains,
+            "exclude_domains": exclude_domains,
+            "include_images": include_images,
+            "api_key": self.api_key,
+            "use_cache": use_cache,
+        }
+        response = self.session.post(self.base_url, data=json.dumps(data), headers=self.headers)
+
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 429:
+            detail = 'Too many requests.'
+            try:
+                detail = response.json()['detail']['error']
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise UsageLimitExceededError(detail)
+        elif response.status_code == 401:
+            raise InvalidAPIKeyError()
+        response.raise_for_status()
+
+
+@lru_cache(maxsize=None)
+def get_tavily_client():
+    """
+    Return the shared Tavily client.
+
+    Returns:
+        PooledTavilyClient: The client, using the TAVILY_API_KEY environment variable.
+    """
+    return PooledTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+
+@lru_cache(maxsize=None)
+def get_geolocator():
+    """
+    Return the shared Nominatim geolocator, with a pooled and retrying HTTP adapter.
+
+    Returns:
+        Nominatim: The geolocator.
+    """
+    return Nominatim(user_agent="abcd",
+                     domain=NOMINATIM_DOMAIN,
+                     scheme=NOMINATIM_SCHEME,
+                     timeout=HTTP_READ_TIMEOUT_SECONDS,
+                     adapter_factory=partial(RequestsAdapter,
+                                             pool_maxsize=HTTP_POOL_MAXSIZE,
+                                             max_retries=HTTP_MAX_RETRIES))
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """
+    Return the shared OpenAI client.
+
+    Returns:
+        OpenAI: The client, using the OPENAI_API_KEY and OPENAI_BASE_URL environment variables.
+    """
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"),
+                  base_url=os.getenv("OPENAI_BASE_URL"),
+                  timeout=OPENAI_TIMEOUT_SECONDS,
+                  max_retries=HTTP_MAX_RETRIES)
+
+
+def get_async_openai_client():
+    """
+    Return the AsyncOpenAI client of the running event loop.
+
+    Async connection pools are bound to their event loop, so one client is
+    kept per loop.
+
+    Returns:
+        AsyncOpenAI: The client, using the OPENAI_API_KEY and OPENAI_BASE_URL environment variables.
+    """
+    loop = asyncio.get_running_loop()
+    with _async_openai_lock:
+        client = _async_openai_clients.get(loop)
+        if client is None:
+            client = _async_openai_clients[loop] = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL"),
+                timeout=OPENAI_TIMEOUT_SECONDS,
+                max_retries=HTTP_MAX_RETRIES)
+    return client
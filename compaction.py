@@ -0,0 +1,183 @@
+import os
+import re
+import threading
+import time
+
+import tiktoken
+
+# Token budget of the conversation part of the summary prompt
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", 6000))
+# Characters per token assumed when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# Seconds before loading an encoding that failed to load is tried again
+ENCODING_RETRY_SECONDS = 60
+
+# Control words the agents exchange, which carry nothing for the summary
+BOILERPLATE = re.compile(r"\b(TERMINATE|TASK_COMPLETED)\b")
+WHITESPACE = re.compile(r"\s+")
+TRUNCATION_MARKER = "[...] "
+
+_totals = {"calls": 0, "tokens_before": 0, "tokens_after": 0, "tokens_saved": 0}
+_totals_lock = threading.Lock()
+_encodings = {}
+_encoding_failures = {}
+
+
+def get_encoding(model):
+    """
+    Return the tiktoken encoding of a model.
+
+    Loaded encodings are kept for the life of the process; a failed load is
+    tried again after ENCODING_RETRY_SECONDS, estimating tokens meanwhile.
+
+    Args:
+        model (str): The model name, e.g. "gpt-4".
+
+    Returns:
+        tiktoken.Encoding: The encoding, or None when it cannot be loaded
+        (tiktoken downloads its encodings on first use).
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    if time.monotonic() < _encoding_failures.get(model, 0.0):
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = get_encoding("gpt-4") if model != "gpt-4" else None
+    except Exception:
+        encoding = None
+    if encoding is None:
+        _encoding_failures[model] = time.monotonic() + ENCODING_RETRY_SECONDS
+    else:
+        _encodings[model] = encoding
+    return encoding
+
+
+def count_tokens(text, model="gpt-4"):
+    """
+    Count the tokens of a text, estimating from its length without a tokenizer.
+
+    Args:
+        text (str): The text.
+        model (str): The model whose tokenizer is used.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model="gpt-4"):
+    """
+    Keep the end of a text that fits in a number of tokens.
+
+    Args:
+        text (str): The text.
+        max_tokens (int): The maximum number of tokens kept.
+        model (str): The model whose tokenizer is used.
+
+    Returns:
+        str: The end of the text, prefixed with TRUNCATION_MARKER when cut.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model)
+    if encoding is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= max_chars else TRUNCATION_MARKER + text[-max_chars:]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return TRUNCATION_MARKER + encoding.decode(tokens[-max_tokens:])
+
+
+def message_text(message):
+    """
+    Return the text of a message without the agents' control words.
+
+    Messages that only carry tool calls (no content) give an empty text.
+
+    Args:
+        message (dict or str): The autogen message.
+
+    Returns:
+        str: The stripped text.
+    """
+    content = message.get("content") if isinstance(message, dict) else message
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return BOILERPLATE.sub("", content or "").strip()
+
+
+def compact_messages(messages, max_tokens=SUMMARY_CONTEXT_TOKENS, model="gpt-4"):
+    """
+    Compact a conversation to a token budget.
+
+    Empty and tool-call-only messages are dropped, repeated messages are kept
+    once (at their latest position), then the newest messages are kept until
+    the budget is used: the message crossing it is truncated to its end and
+    older ones are left out.
+
+    Args:
+        messages (iterable): The autogen messages, oldest first.
+        max_tokens (int): Token budget of the kept messages.
+        model (str): The model whose tokenizer is used.
+
+    Returns:
+        tuple: (texts, report) with the kept message texts, oldest first, and
+        a dict with the tokens before/after compaction, the tokens saved and
+        the number of duplicate and omitted messages.
+    """
+    texts = [message_text(message) for message in messages]
+    tokens_before = sum(count_tokens(text, model) for text in texts if text)
+
+    kept = []
+    seen = set()
+    duplicates = omitted = 0
+    budget = max_tokens
+    for text in reversed(texts):
+        if not text:
+            continue
+        normalized = WHITESPACE.sub(" ", text)
+        if normalized in seen:
+            duplicates += 1
+            continue
+        seen.add(normalized)
+        if budget <= 0:
+            omitted += 1
+            continue
+        tokens = count_tokens(text, model)
+        if tokens > budget:
+            text = truncate_to_tokens(text, budget, model)
+            tokens = budget
+        kept.append(text)
+        budget -= tokens
+    kept.reverse()
+
+    tokens_after = max_tokens - budget
+    report = {"tokens_before": tokens_before,
+              "tokens_after": tokens_after,
+              "tokens_saved": tokens_before - tokens_after,
+              "duplicates": duplicates,
+              "omitted": omitted}
+    with _totals_lock:
+        _totals["calls"] += 1
+        for key in ("tokens_before", "tokens_after", "tokens_saved"):
+            _totals[key] += report[key]
+    return kept, report
+
+
+def compaction_report():
+    """
+    Return the compaction totals since the process started.
+
+    Returns:
+        dict: Number of compactions and tokens before/after/saved.
+    """
+    with _totals_lock:
+        return dict(_totals)
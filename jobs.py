@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+
+from caching import SQLiteCache, make_key
+from planner import build_llm_config, build_plan_chains
+from sessions import get_conversation_store, current_run_id, MAX_RUNS_PER_SESSION
+from tools import get_hotels_map
+from tracing import span
+from utils import run_task_chains_concurrently, ChainOutputStream
+from warm_cache import get_warm_cache, tailored_chain, WARM_CACHE_ENABLED
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", ".cache/jobs.sqlite")
+JOB_RESULTS_TTL_SECONDS = float(os.getenv("JOB_RESULTS_TTL_SECONDS", 24 * 3600))
+PLAN_WORKERS = int(os.getenv("PLAN_WORKERS", 4))
+
+STEPS = ("hotels", "places", "dining")
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class JobLimitExceeded(RuntimeError):
+    """Raised when a user submits a plan while at their limit of running plans."""
+
+
+def plan_job_id(trip):
+    """
+    Return the identifier of the plan job of a trip.
+
+    Identical trips get the same identifier, so a duplicate submission
+    attaches to the job already running or finished.
+
+    Args:
+        trip (dict): The trip details collected from the form.
+
+    Returns:
+        str: The job identifier.
+    """
+    return "plan-" + make_key(trip)[:16]
+
+
+class Job:
+    """
+    A travel plan running in the background, with the status of each step.
+
+    Args:
+        job_id (str): The job identifier.
+        user_id (str): The user (session) that submitted the plan.
+        trip (dict): The trip details collected from the form.
+    """
+
+    def __init__(self, job_id, user_id, trip):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.trip = trip
+        self.status = QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.steps = {name: {"status": QUEUED, "message": None} for name in STEPS}
+        self.output_streams = {}
+
+    def snapshot(self):
+        """
+        Return the state of the job as a plain dictionary.
+
+        Running steps include the agent output streamed so far.
+
+        Returns:
+            dict: Job id, status, error, timestamps and per-step state.
+        """
+        steps = {}
+        for name, step in self.steps.items():
+            steps[name] = dict(step)
+            output_stream = self.output_streams.get(name)
+            if step["status"] == RUNNING and output_stream is not None:
+                steps[name].update(summary=output_stream.summary,
+                                   transcript=output_stream.transcript)
+        return {"job_id": self.job_id,
+                "status": self.status,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "steps": steps}
+
+
+class JobManager:
+    """
+    Run travel plans in a worker pool, independently of the page that submitted them.
+
+    Job states are persisted after every step, so finished plans can be
+    rendered again after a rerun, a browser refresh or a restart. Jobs
+    leave memory once finished and are then read back from the store.
+
+    Args:
+        store (SQLiteCache): Persistent store of the job snapshots.
+        max_workers (int): Number of plans running at the same time.
+        llm_config (dict): Configuration for the LLM, streaming agents by default.
+    """
+
+    def __init__(self, store, max_workers=PLAN_WORKERS, llm_config=None):
+        self.store = store
+        self.llm_config = llm_config if llm_config is not None else build_llm_config(stream=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan-worker")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, user_id, trip):
+        """
+        Submit a travel plan, or attach to the job of an identical one.
+
+        Args:
+            user_id (str): The user (session) submitting the plan.
+            trip (dict): The trip details collected from the form.
+
+        Returns:
+            str: The job identifier.
+
+        Raises:
+            JobLimitExceeded: If the user already has MAX_RUNS_PER_SESSION active plans,
+                as many as the runs their session can hold open.
+        """
+        job_id = plan_job_id(trip)
+        with self._lock:
+            if job_id in self._jobs:
+                return job_id
+            snapshot = self.store.get(job_id)
+            if snapshot is not None and snapshot["status"] == DONE:
+                return job_id
+            active = sum(1 for job in self._jobs.values() if job.user_id == user_id)
+            if active >= MAX_RUNS_PER_SESSION:
+                raise JobLimitExceeded(f"You already have {active} travel plans on their way, "
+                                       f"please wait for one of them to finish.")
+            job = self._jobs[job_id] = Job(job_id, user_id, trip)
+        self._persist(job)
+        self._executor.submit(self._run, job)
+        return job_id
+
+    def get(self, job_id):
+        """
+        Return the state of a job.
+
+        Args:
+            job_id (str): The job identifier.
+
+        Returns:
+            dict: The job snapshot (see Job.snapshot), or None if the job is
+            unknown or expired. A job that was active when the process stopped
+            is reported as failed.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        snapshot = self.store.get(job_id)
+        if snapshot is not None and snapshot["status"] in ACTIVE_STATUSES:
+            snapshot = dict(snapshot, status=FAILED, error="The plan was interrupted, please submit it again.")
+        return snapshot
+
+    def _persist(self, job):
+        snapshot = job.snapshot()
+        for step in snapshot["steps"].values():
+            step.pop("summary", None)
+            step.pop("transcript", None)
+        self.store.set(job.job_id, snapshot)
+
+    def _run(self, job):
+        conversation_store = get_conversation_store()
+        run_id = conversation_store.open_run(job.user_id)
+        # The chains inherit the run id, which keys the map they plot
+        token = current_run_id.set(run_id)
+        try:
+            with span("plan", **{"job.id": job.job_id, "run.id": run_id}) as plan_span:
+                # Popular destinations have their places and dining pre-computed
+                warm_entries = get_warm_cache().lookup(job.trip) if WARM_CACHE_ENABLED else {}
+                warm_chains = {}
+                for name, entry in warm_entries.items():
+                    job.steps[name]["warm"] = True
+                    chain = tailored_chain(name, entry, job.trip)
+                    if chain is None:
+                        job.steps[name].update(status=DONE, message=entry["message"])
+                    else:
+                        warm_chains[name] = chain
+                if plan_span is not None:
+                    plan_span.set_attribute("warm_cache.steps", len(warm_entries))
+                with span("build chains"):
+                    chains = build_plan_chains(job.trip, self.llm_config, conversation_store, run_id,
+                                               steps=[name for name in STEPS if name not in warm_entries])
+                chains.update(warm_chains)
+                for name, chain in chains.items():
+                    chain["output_stream"] = job.output_streams[name] = ChainOutputStream()
+                    job.steps[name]["status"] = RUNNING
+                job.status = RUNNING
+                # Closed before close_run tears the chains down, even on error.
+                # Steps are independent: a failed one leaves the others running.
+                with closing(run_task_chains_concurrently(chains, return_exceptions=True)) \
+                        as completed_chains:
+                    for name, message_task, results in completed_chains:
+                        if isinstance(results, Exception):
+                            job.steps[name].update(status=FAILED,
+                                                   error=f"{type(results).__name__}: {results}")
+                            job.output_streams.pop(name)
+                            self._persist(job)
+                            continue
+                        if name == "hotels":
+                            job.steps[name]["map_html"] = get_hotels_map(run_id)
+                        job.steps[name].update(status=DONE, message=message_task)
+                        compaction = job.output_streams.pop(name).compaction
+                        if compaction is not None:
+                            # Tokens the summary prompt saved by compacting the conversation
+                            job.steps[name]["compaction"] = compaction
+                        self._persist(job)
+            failed_steps = [name for name, step in job.steps.items() if step["status"] == FAILED]
+            if failed_steps:
+                job.status = FAILED
+                job.error = "; ".join(f"{name}: {job.steps[name]['error']}" for name in failed_steps)
+            else:
+                job.status = DONE
+        except Exception as error:
+            job.status = FAILED
+            job.error = f"{type(error).__name__}: {error}"
+            for step in job.steps.values():
+                if step["status"] in ACTIVE_STATUSES:
+                    step["status"] = FAILED
+        finally:
+            current_run_id.reset(token)
+            job.finished_at = time.time()
+            conversation_store.close_run(run_id)
+            self._persist(job)
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+
+
+@lru_cache(maxsize=None)
+def get_job_manager():
+    """
+    Return the process-wide job manager.
+
+    Returns:
+        JobManager: The shared job manager, persisting to JOBS_DB_PATH.
+    """
+    return JobManager(SQLiteCache(JOBS_DB_PATH, ttl=JOB_RESULTS_TTL_SECONDS))
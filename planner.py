@@ -0,0 +1,637 @@
+# Standard library imports
+import asyncio
+import os
+import threading
+from collections import defaultdict, deque
+from functools import lru_cache, partial
+
+# Third-party library imports
+from autogen import (AssistantAgent, UserProxyAgent, GroupChatManager, GroupChat)
+from autogen.io import IOStream
+
+# Local application imports
+from caching import get_llm_cache, make_key
+from sessions import CRITIC_MESSAGES_MAXLEN
+from tracing import instrument_autogen
+from utils import (render_task, render_agent_sys_msg, create_agent,
+                   get_task_objective, create_user_proxy_agent, to_async_tool)
+from tools import (get_list_of_locations, plot_hotels_on_map, search_tavily, search_tavily_batch,
+                   search_hotels, format_hotel_results)
+
+# Agents' LLM calls, speaker selections and chats are traced
+instrument_autogen()
+
+# "direct" runs the Step 1 tools straight from the form inputs and only asks
+# the LLM for the hotel text; "agents" lets the agents call the tools
+HOTELS_EXECUTION_MODE = os.getenv("HOTELS_EXECUTION_MODE", "direct")
+# Idle agent topologies kept per kind of step, for the next runs
+AGENT_POOL_MAX_IDLE = int(os.getenv("AGENT_POOL_MAX_IDLE", 4))
+# How the critic GroupChats pick the next speaker: "rules" and "round_robin"
+# need no LLM call, "small_model" asks SPEAKER_SELECTION_MODEL and "auto"
+# asks the agents' model
+SPEAKER_SELECTION = os.getenv("SPEAKER_SELECTION", "rules")
+SPEAKER_SELECTION_MODEL = os.getenv("SPEAKER_SELECTION_MODEL", "gpt-4o-mini")
+SPEAKER_SELECTION_MODES = ("rules", "round_robin", "small_model", "auto")
+
+# Common termination check function
+termination_check = lambda x: (
+    x is not None and isinstance(x, dict) and
+    isinstance(x.get("content", ""), str) and
+    x.get("content", "").find("TERMINATE") >= 0
+)
+
+SPINNER_MESSAGES = {
+    "hotels": 'Step 1/3: Curating your travel adventure—finding the best airports and hotels... 🌍✨',
+    "places": 'Step 2/3: Unveiling the gems of your destination—finding the must-see spots... 🌟🏙️',
+    "dining": 'Step 3/3: Savoring the flavors—discovering the must-try dining spots... 🍽️🍷',
+}
+
+# DEFINING TOOLS DICTIONARIES
+tools_task_dict = {
+    "get_list_of_locations": {get_list_of_locations:
+        """Retrieves a list of locations (e.g., hotels)
+            within a city for given arrival and departure dates,
+            and returns a result handle followed by a Markdown table including
+            hotel name, review score, check-in, check-out and price"""},
+    "plot_hotels_on_map": {plot_hotels_on_map:
+        """Plots hotel locations on a folium map.
+        Given a City name, Country name, and the result handle
+        returned by get_list_of_locations"""},
+}
+
+tools_web_search_dict = {
+    "search_tavily_batch": {search_tavily_batch:
+        """Search for information on the web for several queries at once"""},
+    "search_tavily": {search_tavily: """Search for information on the web"""},
+}
+
+
+class TrackableCriticAgent(AssistantAgent):
+    """
+    Critic agent that keeps a copy of every message it receives, so the
+    chain summary can be generated from the critic's point of view.
+    """
+
+    def __init__(self, critic_messages, **kwargs):
+        super().__init__(**kwargs)
+        self.critic_messages = critic_messages
+
+    def _process_received_message(self, message, sender, silent):
+        self.critic_messages.append(message)
+        return super()._process_received_message(message, sender, silent)
+
+
+def build_llm_config(stream=False):
+    """
+    Build the LLM configuration shared by all agents.
+
+    Args:
+        stream (bool): Whether agents stream their replies token by token to
+            the output stream of their chain.
+
+    Returns:
+        dict: The autogen llm_config.
+    """
+    selected_model = "gpt-4-1106-preview"
+    selected_key = os.getenv("OPENAI_API_KEY")
+    base_url = os.getenv("OPENAI_BASE_URL")
+
+    return {
+        #"request_timeout": 600,
+        "config_list": [
+            {"model": selected_model, "api_key": selected_key, "base_url": base_url},
+        ],
+        "seed": 41,  # seed for reproducibility
+        "temperature": 0,  # temperature of 0 means deterministic output
+        "cache_seed": None,  # responses are cached by caching.get_llm_cache instead
+        "stream": stream,
+    }
+
+
+def format_user_input(trip):
+    """
+    Format the trip details used by the hotel search task.
+
+    Args:
+        trip (dict): The trip details collected from the form.
+
+    Returns:
+        str: The formatted user input.
+    """
+    return f"""
+            - City: {trip['city_name']}, \n
+            - Country: {trip['country_option']}, \n
+            - Arrival Date: {trip['arrival_date']}, \n
+            - Departure date: {trip['departure_date']}, \n
+            - Quantity of children travelling: {trip['number_of_kids']}, \n
+            - Children age: {trip['children_age']} , \n
+            - Number of guests: {trip['number_of_guests']} , \n
+            - Number of rooms: {trip['number_of_rooms']} , \n
+            - Travel purpose: {trip['travel_purpose']}
+            """
+
+
+def create_hotels_agents(llm_config):
+    """
+    Create the agents and GroupChat of Step 1 (hotels and airports).
+
+    Args:
+        llm_config (dict): Configuration for the LLM.
+
+    Returns:
+        dict: The agents, by role ("assistant", "user", "critic", "manager").
+    """
+    # create an AssistantAgent instance named "assistant"
+    assistant = create_agent(AssistantAgent,
+                             "assistant",
+                             render_agent_sys_msg('travel_assistant'),
+                             llm_config,
+                             tools_task_dict,
+                             termination_check)
+    user_proxy = create_user_proxy_agent("user", llm_config,
+                                         tools_task_dict, termination_check)
+    user = UserProxyAgent(name="User", human_input_mode="NEVER", is_termination_msg=termination_check, code_execution_config=False)
+    user.register_for_execution(name="get_list_of_locations")(to_async_tool(get_list_of_locations))
+    user.register_for_execution(name="plot_hotels_on_map")(to_async_tool(plot_hotels_on_map))
+
+    critic = TrackableCriticAgent(
+        deque(maxlen=CRITIC_MESSAGES_MAXLEN),
+        name="Critic",
+        system_message=render_agent_sys_msg('critic'),
+        llm_config=llm_config,
+    )
+
+    manager = create_critic_groupchat_manager(assistant, critic, user_proxy, llm_config)
+    return {"assistant": assistant, "user": user, "critic": critic, "manager": manager}
+
+
+def rule_based_speaker_selection(assistant, critic, proxy):
+    """
+    Build a speaker selection function following the critic loop:
+    assistant -> critic -> proxy -> assistant.
+
+    Tool calls go to the proxy, which executes them, and the chat opens
+    with the assistant.
+
+    Args:
+        assistant: The agent doing the task.
+        critic: The agent reviewing the assistant's answers.
+        proxy: The agent executing the tools.
+
+    Returns:
+        callable: The speaker_selection_method of the GroupChat.
+    """
+    transitions = {assistant: critic, critic: proxy, proxy: assistant}
+
+    def rules(last_speaker, groupchat):
+        last_message = groupchat.messages[-1] if groupchat.messages else {}
+        if last_message.get("tool_calls") or last_message.get("function_call"):
+            return proxy
+        return transitions.get(last_speaker, assistant)
+
+    return rules
+
+
+def build_speaker_selection_llm_config(llm_config, model=SPEAKER_SELECTION_MODEL):
+    """
+    Build the LLM configuration of the speaker selection, on a smaller model.
+
+    Args:
+        llm_config (dict): Configuration for the LLM of the agents.
+        model (str): The model picking the next speaker.
+
+    Returns:
+        dict: The llm_config, without streaming (the selection is not shown).
+    """
+    return dict(llm_config,
+                config_list=[dict(config, model=model) for config in llm_config["config_list"]],
+                stream=False)
+
+
+def create_critic_groupchat_manager(assistant, critic, proxy, llm_config,
+                                    speaker_selection=SPEAKER_SELECTION):
+    """
+    Create the GroupChat of an assistant, its critic and the proxy executing
+    its tools, and the manager running it.
+
+    Args:
+        assistant: The agent doing the task.
+        critic: The agent reviewing the assistant's answers.
+        proxy: The agent executing the tools.
+        llm_config (dict): Configuration for the LLM.
+        speaker_selection (str): One of SPEAKER_SELECTION_MODES.
+
+    Returns:
+        GroupChatManager: The manager of the GroupChat.
+    """
+    if speaker_selection not in SPEAKER_SELECTION_MODES:
+        raise ValueError(f"Unknown speaker selection '{speaker_selection}', "
+                         f"expected one of {SPEAKER_SELECTION_MODES}")
+    manager_llm_config = llm_config
+    if speaker_selection == "rules":
+        speaker_selection_method = rule_based_speaker_selection(assistant, critic, proxy)
+    elif speaker_selection == "round_robin":
+        speaker_selection_method = "round_robin"
+    else:
+        speaker_selection_method = "auto"
+        if speaker_selection == "small_model":
+            manager_llm_config = build_speaker_selection_llm_config(llm_config)
+
+    # The round robin order is the one of the critic loop
+    groupchat = GroupChat(agents=[assistant, critic, proxy],
+                          messages=[],
+                          max_round=5,
+                          allow_repeat_speaker=False,
+                          speaker_selection_method=speaker_selection_method)
+    return GroupChatManager(groupchat=groupchat, llm_config=manager_llm_config)
+
+
+def build_hotels_chain(trip, llm_config, critic_messages=None):
+    """
+    Build the chats of Step 1 (hotels and airports), with agents from the agent pool.
+
+    Args:
+        trip (dict): The trip details collected from the form.
+        llm_config (dict): Configuration for the LLM.
+        critic_messages (collections.deque): Buffer receiving the critic messages,
+            e.g. from ConversationStore.buffer. A new bounded buffer by default.
+
+    Returns:
+        dict: The task chain, with the keyword arguments of a_run_sequence_of_tasks.
+    """
+    generate_hotels_table = render_task('generate_hotels_table',
+                                        {'user_input': format_user_input(trip)})
+    generate_hotels_text = render_task('generate_hotels_text', {})
+    generate_hotels_chart = render_task('generate_hotels_chart', {'city_name': trip['city_name'],
+                                                                  'country_option': trip['country_option']})
+
+    agents = get_agent_pool().acquire("hotels", llm_config, create_hotels_agents)
+    if critic_messages is None:
+        critic_messages = deque(maxlen=CRITIC_MESSAGES_MAXLEN)
+    agents["critic"].critic_messages = critic_messages
+    assistant, manager = agents["assistant"], agents["manager"]
+
+    chats_list = [
+        {"recipient": assistant, "message": generate_hotels_table, "summary_method": "last_msg", "cache": get_llm_cache()},
+        {"recipient": manager, "message": generate_hotels_text, "summary_method": "last_msg", "cache": get_llm_cache()},
+        {"recipient": assistant, "message": generate_hotels_chart, "summary_method": "last_msg", "cache": get_llm_cache()},
+    ]
+    return {"user_agent": agents["user"],
+            "chats_list": chats_list,
+            "manager_agent": manager,
+            "critic_messages": critic_messages,
+            "objective": get_task_objective('generate_hotels_text')}
+
+
+def build_hotels_direct_chain(trip, llm_config, critic_messages=None):
+    """
+    Build the direct execution of Step 1 (hotels and airports).
+
+    The hotel search and the map need no decision from a model, so they run
+    from the form inputs (see a_run_hotels_direct) and a single chat asks
+    the LLM for the hotel text.
+
+    Args:
+        trip (dict): The trip details collected from the form.
+        llm_config (dict): Configuration for the LLM.
+        critic_messages (collections.deque): Unused buffer, kept so every chain
+            can be torn down the same way.
+
+    Returns:
+        dict: The task chain, with a_run_hotels_direct as its runner.
+    """
+    agents = get_agent_pool().acquire("hotels_direct", llm_config, create_hotels_writer_agents)
+    if critic_messages is None:
+        critic_messages = deque(maxlen=CRITIC_MESSAGES_MAXLEN)
+    return {"runner": a_run_hotels_direct,
+            "trip": trip,
+            "user_agent": agents["user"],
+            "writer_agent": agents["writer"],
+            "critic_messages": critic_messages}
+
+
+def create_hotels_writer_agents(llm_config):
+    """
+    Create the agents of the direct execution of Step 1.
+
+    Args:
+        llm_config (dict): Configuration for the LLM.
+
+    Returns:
+        dict: The agents, by role ("writer", "user").
+    """
+    writer = AssistantAgent(name="hotels_writer",
+                            system_message=render_agent_sys_msg('hotels_writer'),
+                            llm_config=llm_config)
+    user = UserProxyAgent(name="User", human_input_mode="NEVER", is_termination_msg=termination_check,
+                          code_execution_config=False)
+    return {"writer": writer, "user": user}
+
+
+async def a_run_hotels_direct(trip, user_agent, writer_agent, critic_messages, output_stream=None):
+    """
+    (async) Run Step 1 directly: search the hotels, then plot them while the
+    writer agent turns them into text.
+
+    Args:
+        trip (dict): The trip details collected from the form.
+        user_agent: The agent sending the hotel options to the writer.
+        writer_agent: The agent writing the hotel text.
+        critic_messages (collections.deque): Unused, see build_hotels_direct_chain.
+        output_stream (ChainOutputStream): If given, receives the writer's
+            output and the hotel text instead of the console.
+
+    Returns:
+        tuple: The hotel text and the results of the chat, as returned by
+        a_run_sequence_of_tasks.
+    """
+    result_handle = await to_async_tool(search_hotels)(
+        trip['city_name'], trip['country_option'], trip['travel_purpose'],
+        str(trip['arrival_date']), str(trip['departure_date']), trip['number_of_kids'],
+        trip['children_age'], trip['number_of_guests'], trip['number_of_rooms'])
+    message = render_task('generate_hotels_text_direct',
+                          {'hotels_table': format_hotel_results(result_handle)})
+
+    async def run():
+        _, chat_result = await asyncio.gather(
+            to_async_tool(plot_hotels_on_map)(trip['city_name'], trip['country_option'], result_handle),
+            user_agent.a_initiate_chat(writer_agent, message=message, max_turns=1,
+                                       summary_method="last_msg", cache=get_llm_cache()))
+        return chat_result
+
+    if output_stream is None:
+        chat_result = await run()
+    else:
+        with IOStream.set_default(output_stream):
+            chat_result = await run()
+
+    message_task = chat_result.summary.replace("TERMINATE", "").strip()
+    if output_stream is not None:
+        output_stream.write_summary(message_task)
+    return message_task, ([chat_result], user_agent.chat_messages[writer_agent])
+
+
+def create_websearch_agents(llm_config):
+    """
+    Create the agents and GroupChat of a web search step.
+
+    Args:
+        llm_config (dict): Configuration for the LLM.
+
+    Returns:
+        dict: The agents, by role ("assistant", "user", "critic", "manager").
+    """
+    websearch_assistant = create_agent(AssistantAgent,
+                                       "websearch_assistant",
+                                       render_agent_sys_msg('websearch_assistant'),
+                                       llm_config,
+                                       tools_web_search_dict,
+                                       termination_check)
+    websearch_user_proxy = create_user_proxy_agent("websearch_user", llm_config, tools_web_search_dict, termination_check)
+    websearch_user = UserProxyAgent(name="websearch_user", human_input_mode="NEVER", is_termination_msg=termination_check, code_execution_config=False)
+    websearch_user.register_for_execution(name="search_tavily_batch")(to_async_tool(search_tavily_batch))
+    websearch_user.register_for_execution(name="search_tavily")(to_async_tool(search_tavily))
+
+    websearch_critic = TrackableCriticAgent(
+        deque(maxlen=CRITIC_MESSAGES_MAXLEN),
+        name="WebSearchCritic",
+        system_message=render_agent_sys_msg('websearch_critic'),
+        llm_config=llm_config,
+    )
+
+    web_search_manager = create_critic_groupchat_manager(websearch_assistant, websearch_critic,
+                                                         websearch_user_proxy, llm_config)
+    return {"assistant": websearch_assistant, "user": websearch_user,
+            "critic": websearch_critic, "manager": web_search_manager}
+
+
+def build_websearch_chain(search_task, text_task, objective, llm_config, critic_messages=None):
+    """
+    Build the chats of a web search step, followed by a critic-reviewed text.
+
+    Every chain gets its own agents and GroupChat from the agent pool, so
+    several web search chains can run at the same time without sharing messages.
+
+    Args:
+        search_task (str): The rendered web search task.
+        text_task (str): The rendered task that turns the search results into text.
+        objective (str): The objective used to summarize the critic messages.
+        llm_config (dict): Configuration for the LLM.
+        critic_messages (collections.deque): Buffer receiving the critic messages,
+            e.g. from ConversationStore.buffer. A new bounded buffer by default.
+
+    Returns:
+        dict: The task chain, with the keyword arguments of a_run_sequence_of_tasks.
+    """
+    agents = get_agent_pool().acquire("websearch", llm_config, create_websearch_agents)
+    if critic_messages is None:
+        critic_messages = deque(maxlen=CRITIC_MESSAGES_MAXLEN)
+    agents["critic"].critic_messages = critic_messages
+
+    chats_list = [
+        {"recipient": agents["assistant"], "message": search_task, "summary_method": "last_msg", "cache": get_llm_cache()},
+        {"recipient": agents["manager"], "message": text_task, "summary_method": "last_msg", "cache": get_llm_cache()},
+    ]
+    return {"user_agent": agents["user"],
+            "chats_list": chats_list,
+            "manager_agent": agents["manager"],
+            "critic_messages": critic_messages,
+            "objective": objective}
+
+
+def build_places_chain(trip, llm_config, critic_messages=None):
+    """
+    Build the agents and chats of Step 2 (must-see places).
+
+    Args:
+        trip (dict): The trip details collected from the form.
+        llm_config (dict): Configuration for the LLM.
+        critic_messages (collections.deque): Buffer receiving the critic messages.
+
+    Returns:
+        dict: The task chain, with the keyword arguments of a_run_sequence_of_tasks.
+    """
+    search_places = render_task('search_places', {'city_name': trip['city_name'],
+                                                  'country_option': trip['country_option'],
+                                                  'additional_considerations': trip['additional_considerations']})
+    generate_table_places = render_task('generate_table_places', {})
+    return build_websearch_chain(search_places, generate_table_places,
+                                 get_task_objective('search_places'), llm_config, critic_messages)
+
+
+def build_dining_chain(trip, llm_config, critic_messages=None):
+    """
+    Build the agents and chats of Step 3 (dining options).
+
+    Args:
+        trip (dict): The trip details collected from the form.
+        llm_config (dict): Configuration for the LLM.
+        critic_messages (collections.deque): Buffer receiving the critic messages.
+
+    Returns:
+        dict: The task chain, with the keyword arguments of a_run_sequence_of_tasks.
+    """
+    search_dining_places = render_task('search_dining_places', {'city_name': trip['city_name'],
+                                                                'country_option': trip['country_option'],
+                                                                'dining_options': trip['dining_options']})
+    generate_dining_places_text = render_task('generate_dining_places_text', {})
+    return build_websearch_chain(search_dining_places, generate_dining_places_text,
+                                 get_task_objective('generate_dining_places_text'), llm_config,
+                                 critic_messages)
+
+
+def build_plan_chains(trip, llm_config, conversation_store, run_id, steps=None):
+    """
+    Build the three independent steps of a travel plan.
+
+    Each chain gets its critic messages buffer from the run and is torn down
+    when the run is closed.
+
+    Args:
+        trip (dict): The trip details collected from the form.
+        llm_config (dict): Configuration for the LLM.
+        conversation_store (ConversationStore): The store holding the run.
+        run_id (str): The run the chains belong to.
+        steps (iterable): The steps to build, all of them by default.
+
+    Returns:
+        dict: Mapping of step name ("hotels", "places", "dining") to its task chain.
+    """
+    builders = {"hotels": (build_hotels_direct_chain if HOTELS_EXECUTION_MODE == "direct"
+                           else build_hotels_chain),
+                "places": build_places_chain,
+                "dining": build_dining_chain}
+    chains = {}
+    for name, build_chain in builders.items():
+        if steps is not None and name not in steps:
+            continue
+        chains[name] = build_chain(trip, llm_config, conversation_store.buffer(run_id, name))
+        conversation_store.register_teardown(run_id, partial(teardown_chain, chains[name]))
+    return chains
+
+
+def chain_agents(chain):
+    """
+    Return the agents taking part in a task chain.
+
+    Args:
+        chain (dict): The task chain.
+
+    Returns:
+        list: The distinct agents of the chain.
+    """
+    agents = [chain["user_agent"]]
+    agents += [chain[key] for key in ("manager_agent", "writer_agent") if key in chain]
+    agents += [chat["recipient"] for chat in chain.get("chats_list", ())]
+    if "manager_agent" in chain:
+        agents += chain["manager_agent"].groupchat.agents
+    return list({id(agent): agent for agent in agents}.values())
+
+
+def teardown_chain(chain):
+    """
+    Release the conversation state of a finished task chain.
+
+    Resets its agents (message histories, reply counters, usage and chat
+    results) and GroupChat, clears its critic messages and gives the agents
+    back to the agent pool, so a run does not keep them alive after its
+    output is rendered. The chain must have finished running (see
+    utils.run_task_chains_concurrently).
+
+    Args:
+        chain (dict): The task chain.
+    """
+    for agent in chain_agents(chain):
+        agent.reset()
+        # reset() keeps the results of the last initiate_chats
+        vars(agent).pop("_finished_chats", None)
+    if "manager_agent" in chain:
+        chain["manager_agent"].groupchat.reset()
+    chain["critic_messages"].clear()
+    get_agent_pool().release(chain["user_agent"])
+
+
+class AgentPool:
+    """
+    Pool of ready-made agent topologies, so a run reuses the agents, tool
+    schemas and GroupChats of a finished run instead of building them again.
+
+    Agents are taken with acquire() for the duration of a run and given back
+    with release() once reset (see teardown_chain). Topologies are kept per
+    kind and llm_config.
+
+    Args:
+        max_idle (int): Topologies kept per kind and llm_config; extra ones are dropped.
+    """
+
+    def __init__(self, max_idle=AGENT_POOL_MAX_IDLE):
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+        self._in_use = {}
+
+    def acquire(self, kind, llm_config, factory):
+        """
+        Take an idle topology, creating one if there is none.
+
+        Args:
+            kind (str): The kind of topology, e.g. "hotels".
+            llm_config (dict): Configuration for the LLM.
+            factory (callable): Function creating the topology from llm_config.
+                Its result must have a "user" agent, which starts the chats.
+
+        Returns:
+            dict: The agents of the topology, by role.
+        """
+        key = (kind, make_key(llm_config))
+        with self._lock:
+            agents = self._idle[key].pop() if self._idle[key] else None
+        created = agents is None
+        if created:
+            # Built outside the lock, so other plans are not held up
+            agents = factory(llm_config)
+        with self._lock:
+            if created:
+                self.created += 1
+            else:
+                self.reused += 1
+            self._in_use[id(agents["user"])] = (key, agents)
+        return agents
+
+    def release(self, user_agent):
+        """
+        Give back the topology started by user_agent. Unknown agents are ignored.
+
+        Args:
+            user_agent: The "user" agent of an acquired topology.
+        """
+        with self._lock:
+            key, agents = self._in_use.pop(id(user_agent), (None, None))
+            if key is not None and len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(agents)
+
+    def stats(self):
+        """
+        Return the number of topologies created, reused, idle and in use.
+
+        Returns:
+            dict: The pool counters.
+        """
+        with self._lock:
+            return {"created": self.created,
+                    "reused": self.reused,
+                    "idle": sum(len(idle) for idle in self._idle.values()),
+                    "in_use": len(self._in_use)}
+
+
+@lru_cache(maxsize=None)
+def get_agent_pool():
+    """
+    Return the process-wide agent pool.
+
+    Returns:
+        AgentPool: The shared pool.
+    """
+    return AgentPool()
@@ -0,0 +1,143 @@
+import contextvars
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+# Critic messages kept per chain: a chain has a few GroupChat rounds, so this
+# only bounds runaway conversations
+CRITIC_MESSAGES_MAXLEN = 200
+# Runs a session can hold open at the same time, which is also the number
+# of plans a user can have on their way (see jobs.JobManager)
+MAX_RUNS_PER_SESSION = int(os.getenv("MAX_RUNS_PER_SESSION", 2))
+
+# Run whose chains are executing, so tools can key their artifacts by run.
+# Coroutines and asyncio.to_thread calls inherit it from the thread
+# scheduling the run.
+current_run_id = contextvars.ContextVar("current_run_id", default=None)
+
+
+class RunLimitExceeded(RuntimeError):
+    """Raised when a session opens a run while holding max_runs_per_session runs."""
+
+
+class ConversationStore:
+    """
+    Session-scoped store of the per-run conversation buffers.
+
+    Each plan run gets its own bounded message buffers. Closing the run
+    clears them and calls its teardown callbacks (e.g. to clear agent
+    histories), so nothing outlives the run.
+
+    Args:
+        max_runs_per_session (int): Runs a session can hold open at the same time.
+        buffer_maxlen (int): Maximum number of messages in a buffer.
+    """
+
+    def __init__(self, max_runs_per_session=MAX_RUNS_PER_SESSION,
+                 buffer_maxlen=CRITIC_MESSAGES_MAXLEN):
+        self.max_runs_per_session = max_runs_per_session
+        self.buffer_maxlen = buffer_maxlen
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._runs = {}
+
+    def open_run(self, session_id):
+        """
+        Open a new run for a session.
+
+        Open runs are never closed here: their chains may still be running,
+        and closing a run resets its agents and gives them back to the pool.
+
+        Args:
+            session_id (str): The session identifier.
+
+        Returns:
+            str: The run identifier.
+
+        Raises:
+            RunLimitExceeded: If the session already holds max_runs_per_session runs.
+        """
+        run_id = uuid.uuid4().hex
+        with self._lock:
+            runs = self._sessions.setdefault(session_id, OrderedDict())
+            if len(runs) >= self.max_runs_per_session:
+                raise RunLimitExceeded(f"Session {session_id} already has {len(runs)} open runs.")
+            runs[run_id] = None
+            self._runs[run_id] = {"session_id": session_id, "buffers": {}, "teardowns": []}
+        return run_id
+
+    def buffer(self, run_id, name):
+        """
+        Return a bounded message buffer of a run, creating it if needed.
+
+        Args:
+            run_id (str): The run identifier.
+            name (str): The buffer name, e.g. the chain name.
+
+        Returns:
+            collections.deque: The buffer, keeping the last buffer_maxlen messages.
+        """
+        with self._lock:
+            buffers = self._runs[run_id]["buffers"]
+            if name not in buffers:
+                buffers[name] = deque(maxlen=self.buffer_maxlen)
+            return buffers[name]
+
+    def register_teardown(self, run_id, callback):
+        """
+        Register a function called when the run is closed.
+
+        Args:
+            run_id (str): The run identifier.
+            callback (callable): Function called without arguments.
+        """
+        with self._lock:
+            self._runs[run_id]["teardowns"].append(callback)
+
+    def close_run(self, run_id):
+        """
+        Tear down a run: call its teardown callbacks and clear its buffers.
+
+        Closing an unknown or already closed run does nothing.
+
+        Args:
+            run_id (str): The run identifier.
+        """
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            if run is None:
+                return
+            runs = self._sessions.get(run["session_id"])
+            runs.pop(run_id, None)
+            if not runs:
+                del self._sessions[run["session_id"]]
+        for callback in run["teardowns"]:
+            callback()
+        for buffer in run["buffers"].values():
+            buffer.clear()
+
+    def stats(self):
+        """
+        Return the number of open sessions, runs and buffered messages.
+
+        Returns:
+            dict: The store counters.
+        """
+        with self._lock:
+            return {"sessions": len(self._sessions),
+                    "runs": len(self._runs),
+                    "messages": sum(len(buffer) for run in self._runs.values()
+                                    for buffer in run["buffers"].values())}
+
+
+@lru_cache(maxsize=None)
+def get_conversation_store():
+    """
+    Return the process-wide conversation store.
+
+    Returns:
+        ConversationStore: The shared store.
+    """
+    return ConversationStore()
@@ -1,32 +1,110 @@
-import requests
-from typing import List, Tuple
-from geopy.geocoders import Nominatim
+from typing import List
+from geopy.extra.rate_limiter import RateLimiter
 from typing_extensions import Annotated
 import folium
+from folium.plugins import MarkerCluster
 from dotenv import load_dotenv
 import pandas as pd
 import os
-from tavily import TavilyClient
 import html_to_json
 import json
 import warnings
+import asyncio
+import re
+from airports import get_airport_index, has_coordinates
+from caching import TTLCache, SQLiteCache, SingleFlight, make_key
+from clients import get_http_session, get_tavily_client, get_geolocator, timed
+from sessions import current_run_id
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import math
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 load_dotenv('./.env')
 
-LIST_BY_MAP_URL = "https://apidojo-booking-v1.p.rapidapi.com/properties/list-by-map"
+BOOKING_API_BASE_URL = os.getenv("BOOKING_API_BASE_URL", "https://apidojo-booking-v1.p.rapidapi.com")
+LIST_BY_MAP_URL = f"{BOOKING_API_BASE_URL}/properties/list-by-map"
 LIST_BY_MAP_HEADERS = {
     'x-rapidapi-host': "apidojo-booking-v1.p.rapidapi.com",
     'x-rapidapi-key': os.getenv("RAPID_API_KEY")
 }
 
+# Hotel search results are shared by identical queries for this many seconds
+LIST_BY_MAP_CACHE_TTL_SECONDS = float(os.getenv("LIST_BY_MAP_CACHE_TTL_SECONDS", 900))
+_list_by_map_cache = TTLCache(maxsize=256, ttl=LIST_BY_MAP_CACHE_TTL_SECONDS)
+_list_by_map_flights = SingleFlight()
+
+# Large city bounding boxes can be searched as a grid of tiles of at most
+# this size, fetched concurrently, so hotels are not limited to a single
+# page. Each tile costs a request: tiling is off (1 tile per side) by default.
+HOTEL_SEARCH_TILE_KM = float(os.getenv("HOTEL_SEARCH_TILE_KM", 15))
+HOTEL_SEARCH_MAX_TILES_PER_SIDE = int(os.getenv("HOTEL_SEARCH_MAX_TILES_PER_SIDE", 1))
+# Result pages fetched per tile; the pages after the first are fetched together
+HOTEL_SEARCH_MAX_PAGES = int(os.getenv("HOTEL_SEARCH_MAX_PAGES", 1))
+# List-by-map requests running at the same time, across all searches
+HOTEL_SEARCH_MAX_CONCURRENCY = int(os.getenv("HOTEL_SEARCH_MAX_CONCURRENCY", 4))
+_list_by_map_executor = None
+_list_by_map_executor_lock = threading.Lock()
+KM_PER_DEGREE = 111.2
+
+# Structured hotel results, looked up by the result handle given to the agents
+HOTEL_RESULTS_TTL_SECONDS = 3600
+_hotel_results = TTLCache(maxsize=128, ttl=HOTEL_RESULTS_TTL_SECONDS)
+# Columns kept from the list-by-map results
+HOTEL_COLUMNS = ['latitude', 'longitude', 'url', 'hotel_name', 'address',
+                 'review_score_word', 'checkin', 'checkout']
+# Review score words of the hotel options kept
+HOTEL_REVIEW_WORDS = ['Fair', 'Good', 'Pleasant', 'Okay', 'Excellent']
+HOTEL_REVIEW_WORD_DTYPE = pd.CategoricalDtype(HOTEL_REVIEW_WORDS)
+# Unfiltered hotel options are also written there for inspection, if set
+# (e.g. csv_files/booking_options.csv)
+HOTEL_RESULTS_CSV_PATH = os.getenv("HOTEL_RESULTS_CSV_PATH")
+_hotel_results_dump_executor = None
+_hotel_results_dump_lock = threading.Lock()
+# Hotel options listed to the LLM (all of them are plotted on the map)
+HOTEL_TABLE_MAX_ROWS = int(os.getenv("HOTEL_TABLE_MAX_ROWS", 40))
+# Columns of the hotel results shown to the LLM
+HOTEL_SUMMARY_COLUMNS = ['hotel_name', 'review_score_word', 'checkin', 'checkout',
+                         'All-Inclusive-Price']
+
+# Rendered hotel maps (HTML), looked up by run id or result handle
+HOTEL_MAPS_MAXSIZE = 64
+HOTEL_MAPS_MAX_BYTES = 64 * 1024 * 1024
+_hotel_maps = TTLCache(maxsize=HOTEL_MAPS_MAXSIZE, ttl=HOTEL_RESULTS_TTL_SECONDS,
+                       max_bytes=HOTEL_MAPS_MAX_BYTES)
+
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+# Web search results are shared by queries with the same words for this many seconds
+TAVILY_CACHE_TTL_SECONDS = float(os.getenv("TAVILY_CACHE_TTL_SECONDS", 6 * 3600))
+# Searches of a batch running at the same time
+TAVILY_MAX_CONCURRENCY = int(os.getenv("TAVILY_MAX_CONCURRENCY", 4))
+# Characters kept of the content of each search result given to the LLM
+TAVILY_CONTENT_MAX_CHARS = int(os.getenv("TAVILY_CONTENT_MAX_CHARS", 600))
+_tavily_cache = TTLCache(maxsize=512, ttl=TAVILY_CACHE_TTL_SECONDS)
+_tavily_flights = SingleFlight()
+QUERY_WORD = re.compile(r"\w+")
+
+# Bounding boxes geocoded by Nominatim are kept across runs
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", ".cache/geocode.sqlite")
+# Nominatim usage policy: at most one request per second
+NOMINATIM_MIN_DELAY_SECONDS = 1.0
+_geocode_store = None
+_geocode = None
+_geocode_lock = threading.Lock()
+
+# Radius used to look for airports when none is registered for the city itself
+AIRPORT_SEARCH_RADIUS_KM = 50
 
 def get_city_bbox(city_name: Annotated[str, "Name of the city"],
                   country_name: Annotated[str,"Name of the country"]) -> str:
     """
     Retrieve the bounding box for a specified city and country.
 
+    The bounding box comes from the persistent geocoding store, then from
+    the airports of the city when several of them bound it closely, and
+    otherwise from Nominatim, geocoding the city once: its box is kept in
+    the store.
+
     Args:
         city_name (str): The name of the city.
         country_name (str): The name of the country.
@@ -37,13 +115,185 @@ def get_city_bbox(city_name: Annotated[str, "Name of the city"],
     Raises:
         AttributeError: If the geocoding service does not return a bounding box.
     """
-    geolocator = Nominatim(user_agent = "abcd")
-    location = geolocator.geocode(f"{city_name}, {country_name}")
-    bounding_box = location.raw['boundingbox']
+    bounding_box = get_bbox_store().get(make_key(city_name.upper(), country_name.upper()))
+
+    if bounding_box is None:
+        # Offline gazetteer built from the airports of the city
+        airport_bbox = get_airport_index().city_bounding_box(city_name, country_name)
+        if airport_bbox is not None:
+            bounding_box = [f"{coordinate:.7f}" for coordinate in airport_bbox]
+
+    if bounding_box is None:
+        with timed("nominatim geocode"):
+            location = get_geocoder()(f"{city_name}, {country_name}")
+        bounding_box = location.raw['boundingbox']
+        get_bbox_store().set(make_key(city_name.upper(), country_name.upper()), bounding_box)
     
     return "%2C".join(bounding_box)
 
 
+def get_bbox_store():
+    """
+    Return the persistent (city, country) -> bounding box store.
+
+    Returns:
+        SQLiteCache: The store located at GEOCODE_CACHE_PATH.
+    """
+    global _geocode_store
+    with _geocode_lock:
+        if _geocode_store is None:
+            _geocode_store = SQLiteCache(GEOCODE_CACHE_PATH)
+    return _geocode_store
+
+
+def get_geocoder():
+    """
+    Return the shared Nominatim geocode function, rate limited to the service policy.
+
+    Returns:
+        RateLimiter: A callable with the signature of Nominatim.geocode.
+    """
+    global _geocode
+    with _geocode_lock:
+        if _geocode is None:
+            _geocode = RateLimiter(get_geolocator().geocode,
+                                   min_delay_seconds=NOMINATIM_MIN_DELAY_SECONDS)
+    return _geocode
+
+
+def fetch_list_by_map(querystring):
+    """
+    Call the Booking list-by-map endpoint, sharing results between identical queries.
+
+    Responses are cached for LIST_BY_MAP_CACHE_TTL_SECONDS, and concurrent
+    identical queries wait for a single upstream call.
+
+    Args:
+        querystring (dict): The query parameters of the request.
+
+    Returns:
+        dict: The decoded JSON response.
+    """
+    key = make_key(sorted((name, str(value).strip()) for name, value in querystring.items()))
+    response = _list_by_map_cache.get(key)
+    if response is not None:
+        return response
+
+    def _fetch():
+        response = get_http_session("booking").get(LIST_BY_MAP_URL,
+                                                   headers=LIST_BY_MAP_HEADERS,
+                                                   params=querystring).json()
+        if 'result' in response:
+            _list_by_map_cache.set(key, response)
+        return response
+
+    return _list_by_map_flights.do(key, _fetch)
+
+
+def split_bbox(bbox, tile_km=HOTEL_SEARCH_TILE_KM, max_tiles_per_side=HOTEL_SEARCH_MAX_TILES_PER_SIDE):
+    """
+    Split a bounding box into a grid of tiles of at most tile_km per side.
+
+    Args:
+        bbox (str): The bounding box, as returned by get_city_bbox.
+        tile_km (float): The largest tile side, in kilometers.
+        max_tiles_per_side (int): The largest number of rows and columns of the grid.
+
+    Returns:
+        list: The tiles, in the format of bbox, row by row.
+    """
+    south, north, west, east = (float(value) for value in bbox.split("%2C"))
+    cos_lat = max(0.01, math.cos(math.radians((south + north) / 2)))
+    rows = max(1, min(max_tiles_per_side, math.ceil((north - south) * KM_PER_DEGREE / tile_km)))
+    cols = max(1, min(max_tiles_per_side, math.ceil((east - west) * KM_PER_DEGREE * cos_lat / tile_km)))
+    if rows == cols == 1:
+        return [bbox]
+    lat_step, lon_step = (north - south) / rows, (east - west) / cols
+    return ["%2C".join(f"{coordinate:.7f}" for coordinate in
+                       (south + row * lat_step, south + (row + 1) * lat_step,
+                        west + col * lon_step, west + (col + 1) * lon_step))
+            for row in range(rows) for col in range(cols)]
+
+
+def get_list_by_map_executor():
+    """
+    Return the thread pool bounding the concurrent list-by-map requests.
+
+    Returns:
+        ThreadPoolExecutor: The shared pool, of HOTEL_SEARCH_MAX_CONCURRENCY threads.
+    """
+    global _list_by_map_executor
+    with _list_by_map_executor_lock:
+        if _list_by_map_executor is None:
+            _list_by_map_executor = ThreadPoolExecutor(max_workers=HOTEL_SEARCH_MAX_CONCURRENCY,
+                                                       thread_name_prefix="list-by-map")
+    return _list_by_map_executor
+
+
+def list_hotels_by_map(querystring, max_pages=HOTEL_SEARCH_MAX_PAGES):
+    """
+    Search hotels tile by tile and page by page.
+
+    The bounding box of the query is split with split_bbox. The first page
+    of every tile is fetched at once; when a tile reports more options than
+    its first page, its next pages (up to max_pages) are fetched together.
+    Pages are merged in page, then tile order, so the most popular options
+    of every tile come first, and hotels already listed (same hotel_id) are
+    left out.
+
+    Args:
+        querystring (dict): The query parameters of the whole search.
+        max_pages (int): Pages fetched at most per tile.
+
+    Returns:
+        list: The hotels found.
+
+    Raises:
+        KeyError: If no tile returned results.
+    """
+    executor = get_list_by_map_executor()
+    futures = {}
+
+    def submit(tile_index, tile, page, offset):
+        query = dict(querystring, bbox=tile)
+        if offset:
+            query["offset"] = str(offset)
+        futures[executor.submit(fetch_list_by_map, query)] = (page, tile_index, tile)
+
+    for tile_index, tile in enumerate(split_bbox(querystring["bbox"])):
+        submit(tile_index, tile, 0, 0)
+
+    pages = {}
+    try:
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                page, tile_index, tile = futures.pop(future)
+                response = future.result()
+                if 'result' not in response:
+                    continue
+                hotels = pages[page, tile_index] = response['result']
+                if page == 0 and hotels:
+                    count = response.get('count') or 0
+                    for next_page in range(1, min(max_pages, math.ceil(count / len(hotels)))):
+                        submit(tile_index, tile, next_page, next_page * len(hotels))
+    finally:
+        for future in futures:
+            future.cancel()
+    if not pages:
+        raise KeyError('result')
+
+    seen = set()
+    hotels = []
+    for index in sorted(pages):
+        for hotel in pages[index]:
+            hotel_id = hotel.get('hotel_id', hotel.get('url'))
+            if hotel_id not in seen:
+                seen.add(hotel_id)
+                hotels.append(hotel)
+    return hotels
+
+
 def get_list_of_locations(city_name: Annotated[str, "Name of the city"],
     country_name : Annotated[str, "Name of the country"],
     travel_purpose: Annotated[str, "Travel purpose. Can be either leisure or business"],
@@ -68,12 +318,29 @@ def get_list_of_locations(city_name: Annotated[str, "Name of the city"],
         room_qty (int): Quantity of rooms.
 
     Returns:
-        str: A Markdown-formatted table of hotel options based on the provided criteria.
+        str: The result handle of the hotel options, followed by a compact
+        Markdown table of them. The full results (including coordinates and
+        booking URLs) are kept in memory and retrieved with the handle.
+
+    Raises:
+        KeyError: If the response from the API does not contain the expected fields.
+    """
+    result_handle = search_hotels(city_name, country_name, travel_purpose, arrival_date,
+                                  departure_date, children_qty, children_age, guest_qty, room_qty)
+    return format_hotel_results(result_handle)
+
+
+def search_hotels(city_name, country_name, travel_purpose, arrival_date, departure_date,
+                  children_qty, children_age, guest_qty, room_qty):
+    """
+    Search hotel options and keep them in memory (see get_list_of_locations).
+
+    Returns:
+        str: The result handle of the hotel options.
 
     Raises:
         KeyError: If the response from the API does not contain the expected fields.
     """
-    
     list_by_map_querystring = {
     "search_id":"none",
     "children_age": "" if children_qty == 0 else children_age,
@@ -90,66 +357,188 @@ def get_list_of_locations(city_name: Annotated[str, "Name of the city"],
     "arrival_date":arrival_date
     }
     
-    list_by_map_response = requests.request("GET", 
-                                        LIST_BY_MAP_URL,
-                                        headers=LIST_BY_MAP_HEADERS, 
-                                        params=list_by_map_querystring).json()
-    
-    data = list_by_map_response['result']
+    df = normalize_hotel_results(list_hotels_by_map(list_by_map_querystring))
+    dump_hotel_results(df)
+    return store_hotel_results(filter_hotel_results(df), list_by_map_querystring)
 
-    columns = [
-    'latitude', 'longitude', 'url', 'hotel_name', 
-    'address', 'review_score_word', 'checkin', 'checkout',
-    'price_breakdown'
-    ]
-    
-    df = pd.DataFrame(data, columns=columns)
-    
-    df['Float-Price'] = df['price_breakdown'].apply(lambda x: x['all_inclusive_price'])
-    df['All-Inclusive-Price'] = df['price_breakdown'].apply(lambda x: str(x['currency'])  + ' ' + str(x['all_inclusive_price']))
-    
-    # Keeping only the most interesting columns
-    df.drop('Float-Price',axis=1,inplace=True)
-    # Saving in csv for later inspection
-    df.to_csv('csv_files/booking_options.csv',index=False)
-    
-    df=df.query("review_score_word == 'Fair' | review_score_word == 'Good' | review_score_word == 'Pleasant'|  review_score_word == 'Okay' | review_score_word == 'Excellent'")
-    df=df.drop('price_breakdown',axis=1)
-    
-    # For testing purposes, it might be interesting to comment all above and run only this:
-    # df=pd.read_csv('files/booking_options.csv').query("review_score_word == 'Fair' | review_score_word == 'Good' | review_score_word == 'Pleasant'|  review_score_word == 'Okay' | review_score_word == 'Excellent'")
-    # df=df[[
-    # 'latitude', 'longitude', 'url', 'hotel_name', 
-    # 'address', 'review_score_word', 'checkin', 'checkout',
-    # 'price_breakdown','All-Inclusive-Price'
-    # ]]
-    return df.to_markdown(tablefmt="grid")
+
+def normalize_hotel_results(data):
+    """
+    Build the table of hotel options from the list-by-map results.
+
+    The price_breakdown of every option is unpacked in one pass and the
+    price label is built column-wise. Prices keep their JSON type, so whole
+    prices read "USD 190" as the API sent them, not "USD 190.0".
+
+    Args:
+        data (list): The "result" entries of the list-by-map response.
+
+    Returns:
+        pd.DataFrame: One row per option, with HOTEL_COLUMNS and the
+        All-Inclusive-Price label (e.g. "USD 190.1").
+
+    Raises:
+        KeyError: If the options have no price currency or all-inclusive price.
+    """
+    df = pd.DataFrame(data, columns=HOTEL_COLUMNS + ['price_breakdown'])
+    prices = pd.DataFrame(df.pop('price_breakdown').tolist(), dtype=object)
+    if df.empty:
+        df['All-Inclusive-Price'] = pd.Series(dtype=object)
+        return df
+    df['All-Inclusive-Price'] = (prices['currency'].astype(str) + ' '
+                                 + prices['all_inclusive_price'].astype(str)).to_numpy()
+    return df
+
+
+def filter_hotel_results(df):
+    """
+    Keep the hotel options with a review score word of HOTEL_REVIEW_WORDS.
+
+    Args:
+        df (pd.DataFrame): The options, as returned by normalize_hotel_results.
+
+    Returns:
+        pd.DataFrame: The kept options, with review_score_word as a categorical column.
+    """
+    df = df[df['review_score_word'].isin(HOTEL_REVIEW_WORDS)]
+    return df.assign(review_score_word=df['review_score_word'].astype(HOTEL_REVIEW_WORD_DTYPE))
+
+
+def dump_hotel_results(df):
+    """
+    Write hotel options to HOTEL_RESULTS_CSV_PATH, if set, for later inspection.
+
+    The file is written in a background thread, so the search does not
+    wait for the disk.
+
+    Args:
+        df (pd.DataFrame): The options, which must not be modified afterwards.
+    """
+    global _hotel_results_dump_executor
+    if not HOTEL_RESULTS_CSV_PATH:
+        return
+    with _hotel_results_dump_lock:
+        if _hotel_results_dump_executor is None:
+            _hotel_results_dump_executor = ThreadPoolExecutor(max_workers=1,
+                                                              thread_name_prefix="hotel-results-dump")
+    _hotel_results_dump_executor.submit(df.to_csv, HOTEL_RESULTS_CSV_PATH, index=False)
+
+
+def format_hotel_results(result_handle):
+    """
+    Format stored hotel options as the result handle followed by a Markdown table.
+
+    Args:
+        result_handle (str): The handle returned by search_hotels.
+
+    Returns:
+        str: The handle, the number of options and the table of HOTEL_SUMMARY_COLUMNS,
+        or an error message when the handle is unknown or expired.
+    """
+    df = get_hotel_results(result_handle)
+    if df is None:
+        return (f"ERROR: unknown or expired result handle '{result_handle}'. "
+                "Call get_list_of_locations again to search again.")
+    listed = (f"{len(df)} hotel options" if len(df) <= HOTEL_TABLE_MAX_ROWS
+              else f"{len(df)} hotel options, the first {HOTEL_TABLE_MAX_ROWS} listed")
+    return (f"Result handle: {result_handle}\n"
+            f"{listed}:\n"
+            f"{df[HOTEL_SUMMARY_COLUMNS].head(HOTEL_TABLE_MAX_ROWS).to_markdown(index=False)}")
+
+
+def store_hotel_results(df, querystring):
+    """
+    Keep hotel results in memory under a handle derived from their query.
+
+    Args:
+        df (pd.DataFrame): The hotel options.
+        querystring (dict): The query that produced them.
+
+    Returns:
+        str: The result handle.
+    """
+    result_handle = "hotels-" + make_key(sorted(querystring.items()))[:12]
+    _hotel_results.set(result_handle, df)
+    return result_handle
+
+
+def get_hotel_results(result_handle):
+    """
+    Retrieve hotel results stored by get_list_of_locations.
+
+    Args:
+        result_handle (str): The handle returned by get_list_of_locations.
+
+    Returns:
+        pd.DataFrame: The hotel options, or None if the handle is unknown or expired.
+    """
+    return _hotel_results.get(result_handle.strip())
 
 
 def plot_hotels_on_map(city_name: Annotated[str,"""String with the city name"""],
     country_name: Annotated[str,"""String with the country name"""],
-    locations: Annotated[List[Tuple],"""List of tuples containing latitude, 
-                        longitude, name of hotel, hotel link, review_score_word. Example: locations= [
-    (9.0, -84.0, "HOTEL NAME", "HOTEL_URL", "HOTEL_RATING")...]
-    """], 
-                       map_center=None):
+    result_handle: Annotated[str,"""Result handle returned by get_list_of_locations.
+    Example: hotels-0123456789ab"""]):
+    """
+    Plots the hotel options of a get_list_of_locations result on a folium map.
+
+    Parameters:
+    - city_name: The name of the city
+    - country_name: The name of the country
+    - result_handle: The handle returned by get_list_of_locations
+
+    Returns:
+    - A message telling whether the map has been plotted
+    """
+    df = get_hotel_results(result_handle)
+    if df is None:
+        return (f"ERROR: unknown or expired result handle '{result_handle}'. "
+                "Call get_list_of_locations again to get a new one.")
+    if df.empty:
+        return "ERROR: the result has no hotel options to plot."
+
+    locations = list(df[['latitude', 'longitude', 'hotel_name', 'url', 'review_score_word']]
+                     .itertuples(index=False, name=None))
+    map_html = plot_locations_on_map(city_name, country_name, locations)
+    _hotel_maps.set(result_handle.strip(), map_html)
+    run_id = current_run_id.get()
+    if run_id is not None:
+        _hotel_maps.set(run_id, map_html)
+
+    return (f"""SUCCESS: Hotel options have been successfully plotted on a folium map"""
+            f"Corresponding city: {city_name}") 
+
+
+def get_hotels_map(key):
+    """
+    Retrieve a map rendered by plot_hotels_on_map.
+
+    Args:
+        key (str): The run id the map was plotted in, or its result handle.
+
+    Returns:
+        str: The HTML page of the map, or None if it is unknown or expired.
+    """
+    return _hotel_maps.get(key)
+
+
+def plot_locations_on_map(city_name, country_name, locations, map_center=None):
     """
-    Plots hotel locations on a folium map.
+    Plots hotel locations, and the airports of the city, on a folium map.
+
+    Hotels are grouped in a marker cluster and airports in their own layer,
+    so maps with hundreds of hotels stay fast in the browser.
 
     Parameters:
-    - locations: List of tuples [(latitude, longitude, hotel_name, url), ...]
+    - locations: List of tuples [(latitude, longitude, hotel_name, url, review_score_word), ...]
     - map_center: Tuple (latitude, longitude) to center the map, defaults to the mean of the locations
-    - zoom_start: Initial zoom level for the map, defaults to 13
 
     Returns:
-    - folium.Map object with the plotted locations
+    - The HTML page of the map
     """
 
     # Filtering the airport by city
-    df = pd.read_csv("csv_files/airports.csv")
-    df=df[df["Country"] == country_name.upper()]
-    df=df[df["City/Town"] == city_name.upper()]
-    print(f"City Name = {city_name.upper()}")
+    airports = get_airport_index().airports_in_city(city_name, country_name)
     
     # If no map center is provided, center the map at the mean of the locations
     if not map_center:
@@ -171,38 +560,38 @@ def plot_hotels_on_map(city_name: Annotated[str,"""String with the city name"""]
     }
     
     # Add markers for each location with popup containing hotel name and link
+    hotels_layer = MarkerCluster(name="Hotels", disableClusteringAtZoom=15).add_to(my_map)
     for lat, lng, hotel_name, url, review_score_word in locations:
         folium.Marker(
             location=(lat, lng),
             popup=f"<b>{hotel_name} - Review: {review_score_word}</b><br><a href='{url}' target='_blank'>Booking Link</a>",
             icon=folium.Icon(color=color_mapping.get(review_score_word,
                                                      "black"), icon='hotel', prefix='fa')
-        ).add_to(my_map)
-    # Add markers for each location corresponding to airports     
-
-    df['IATA Code'] = df['IATA Code'].fillna("N/A")
+        ).add_to(hotels_layer)
+    # Add markers for each location corresponding to airports
+    airports = [airport for airport in airports if has_coordinates(airport)]
+    if not airports:
+        # Cities whose airports are registered under a neighbouring town
+        airports = [airport for _, airport in get_airport_index().airports_within(
+            map_center[0], map_center[1], AIRPORT_SEARCH_RADIUS_KM)]
+    airports_layer = folium.FeatureGroup(name="Airports").add_to(my_map)
     # Counter for "N/A" occurrences
     na_counter = 1
-    # Iterate over the DataFrame and modify "N/A" entries
-    for index, value in df['IATA Code'].items():
-        if value == "N/A":
-            df.at[index, 'IATA Code'] = f"N/A {na_counter}"
+    for airport in airports:
+        iata_code = airport.iata_code
+        if iata_code is None:
+            iata_code = f"N/A {na_counter}"
             na_counter += 1
-    
-    for iata_code in df['IATA Code'].values:
         folium.Marker(
-            location=(df[df['IATA Code'] == iata_code]['Latitude Decimal Degrees'],
-                      df[df['IATA Code'] == iata_code]['Longitude Decimal Degrees']),
-            popup=f"Airport: {df[df['IATA Code'] == iata_code]['Airport Name'].values[0]} \n - {iata_code} ",
+            location=(airport.latitude, airport.longitude),
+            popup=f"Airport: {airport.name or 'N/A'} \n - {iata_code} ",
             icon=folium.Icon(color="red", icon='plane', prefix='fa')
-        ).add_to(my_map)
+        ).add_to(airports_layer)
+    folium.LayerControl().add_to(my_map)
 
-    my_map.save("hotels_map_run.html")
-    
-    return (f"""SUCCESS: Hotel options have been successfully plotted on a folium map"""
-            f"Corresponding city: {city_name}") 
+    return my_map.get_root().render()
 
-def search_tavily(query: Annotated[str, "Query to search on the web"]):
+def search_tavily(query: Annotated[str, "Query to search on the web"]) -> str:
     
     """
     Searches the web using the Tavily API.
@@ -211,20 +600,110 @@ def search_tavily(query: Annotated[str, "Query to search on the web"]):
         query (str): The search query to be used for the web search.
 
     Returns:
-        str: A JSON-formatted string containing the search results.
+        str: A Markdown table with the search results, their content trimmed
+        to TAVILY_CONTENT_MAX_CHARS.
 
     Example:
         >>> search_tavily("latest trends in AI")
-        '{
-            "results": [
-                {"title": "AI Trends 2024", "link": "https://example.com/trends2024"},
-                {"title": "The Future of AI", "link": "https://example.com/futureofai"}
-            ]
-        }'
+        '|    | title          | url                            | content   |
+         |---:|:---------------|:-------------------------------|:----------|
+         |  0 | AI Trends 2024 | https://example.com/trends2024 | ...       |'
     """
-    
-    client = TavilyClient(api_key=TAVILY_API_KEY)
-    response = client.search(query, search_depth="advanced")["results"]
-    df_response=pd.DataFrame(response).drop(['score','raw_content'],axis=1)
-    
+    return format_tavily_results(fetch_tavily_results(query))
+
+
+async def search_tavily_batch(queries: Annotated[List[str], "Queries to search on the web, one per topic"]) -> str:
+    """
+    Searches the web for several queries at once using the Tavily API.
+
+    Queries with the same words are searched once, at most
+    TAVILY_MAX_CONCURRENCY searches run at the same time, and a result
+    already given for a previous query is not repeated.
+
+    Args:
+        queries (list): The search queries.
+
+    Returns:
+        str: A Markdown section with the results table of each query.
+    """
+    unique_queries = {}
+    for query in queries:
+        unique_queries.setdefault(normalize_query(query), query)
+    queries = list(unique_queries.values())
+
+    semaphore = asyncio.Semaphore(TAVILY_MAX_CONCURRENCY)
+
+    async def search(query):
+        async with semaphore:
+            return await asyncio.to_thread(fetch_tavily_results, query)
+
+    batches = await asyncio.gather(*(search(query) for query in queries))
+
+    seen_urls = set()
+    sections = []
+    for query, results in zip(queries, batches):
+        results = [result for result in results if result.get("url") not in seen_urls]
+        seen_urls.update(result.get("url") for result in results)
+        table = format_tavily_results(results) if results else "No new results."
+        sections.append(f"## Results for: {query}\n{table}")
+    return "\n\n".join(sections)
+
+
+def normalize_query(query):
+    """
+    Normalize a search query to its sorted set of lowercase words.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        str: The normalized query, equal for queries that only differ in
+        case, punctuation or word order.
+    """
+    return " ".join(sorted(set(QUERY_WORD.findall(query.lower()))))
+
+
+def fetch_tavily_results(query):
+    """
+    Search the web with Tavily, sharing results between identical normalized queries.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        list: The search results, as returned by the Tavily API.
+    """
+    key = make_key("tavily", normalize_query(query))
+    results = _tavily_cache.get(key)
+    if results is not None:
+        return results
+
+    def _fetch():
+        results = get_tavily_client().search(query, search_depth="advanced")["results"]
+        _tavily_cache.set(key, results)
+        return results
+
+    return _tavily_flights.do(key, _fetch)
+
+
+def trim_content(text, max_chars=TAVILY_CONTENT_MAX_CHARS):
+    """Cut a text to max_chars at a word boundary, marking the cut with an ellipsis."""
+    if not isinstance(text, str) or len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+def format_tavily_results(results):
+    """
+    Format Tavily search results as a Markdown table for the LLM.
+
+    Args:
+        results (list): The search results.
+
+    Returns:
+        str: The table, without scores and raw content, with trimmed content.
+    """
+    df_response = pd.DataFrame(results).drop(['score', 'raw_content'], axis=1, errors='ignore')
+    if 'content' in df_response:
+        df_response['content'] = df_response['content'].map(trim_content)
     return df_response.to_markdown()
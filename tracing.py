@@ -0,0 +1,277 @@
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Spans are appended to this file, one OTLP/JSON export request per line
+TRACES_PATH = os.getenv("TRACES_PATH", ".cache/traces.jsonl")
+# Past this size the file is rotated to TRACES_PATH + ".1", replacing the previous one
+TRACES_MAX_BYTES = int(os.getenv("TRACES_MAX_BYTES", 50 * 1024 * 1024))
+SERVICE_NAME = "autogen-travel-planner"
+
+STATUS_OK, STATUS_ERROR = 1, 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+_export_file = None
+_timings = defaultdict(lambda: {"count": 0, "total_s": 0.0, "max_s": 0.0, "tokens": 0,
+                                "cache_hits": 0, "errors": 0})
+_timings_lock = threading.Lock()
+_instrumented = False
+
+
+class Span:
+    """
+    A timed operation of a plan, exported in the OpenTelemetry span format.
+
+    Spans opened while another one is current become its children, and
+    inherit its step (the name of the enclosing "step ..." span).
+
+    Args:
+        name (str): The operation name, e.g. "tool search_tavily_batch".
+        parent (Span): The enclosing span, None for a root span.
+        attributes (dict): Initial attributes.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.step = name[len("step "):] if name.startswith("step ") else (
+            parent.step if parent is not None else None)
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, value):
+        """Add value to a numeric attribute, starting from 0."""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    @property
+    def duration_s(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        span = {"traceId": self.trace_id,
+                "spanId": self.span_id,
+                "name": self.name,
+                "kind": 1,
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(self.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)}
+                               for key, value in self.attributes.items() if value is not None],
+                "status": {"code": self.status}}
+        if self.parent_span_id is not None:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def current_span():
+    """Return the span of the running operation, or None outside of any span."""
+    return _current_span.get()
+
+
+def record_cache_lookup(hit):
+    """Count a cache hit or miss on the current span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.add("cache.hits" if hit else "cache.misses", 1)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Run the enclosed block in a span, exported when the block exits.
+
+    Args:
+        name (str): The operation name.
+        **attributes: Initial span attributes.
+
+    Yields:
+        Span: The span, to add attributes to (or None when tracing is disabled).
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as error:
+        current.status = STATUS_ERROR
+        current.status_message = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        _finish(current)
+
+
+def _finish(current):
+    tokens = current.attributes.get("llm.usage.total_tokens", 0)
+    with _timings_lock:
+        timing = _timings[(current.step or "-", current.name)]
+        timing["count"] += 1
+        timing["total_s"] += current.duration_s
+        timing["max_s"] = max(timing["max_s"], current.duration_s)
+        timing["tokens"] += tokens
+        timing["cache_hits"] += current.attributes.get("cache.hits", 0)
+        timing["errors"] += current.status == STATUS_ERROR
+    _export(current)
+
+
+def _export(current):
+    global _export_file
+    request = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [current.to_otlp()]}]}]}
+    line = json.dumps(request, default=str) + "\n"
+    with _export_lock:
+        if _export_file is not None and _export_file.tell() >= TRACES_MAX_BYTES:
+            _export_file.close()
+            os.replace(TRACES_PATH, TRACES_PATH + ".1")
+            _export_file = None
+        if _export_file is None:
+            if os.path.dirname(TRACES_PATH):
+                os.makedirs(os.path.dirname(TRACES_PATH), exist_ok=True)
+            _export_file = open(TRACES_PATH, "a", encoding="utf-8")
+        _export_file.write(line)
+        _export_file.flush()
+
+
+def payload_size(payload):
+    """Return the size in characters of a payload, as JSON when it is not a string."""
+    if isinstance(payload, str):
+        return len(payload)
+    return len(json.dumps(payload, default=str))
+
+
+def timing_table():
+    """
+    Return the span durations aggregated per step and operation.
+
+    Returns:
+        list: One dict per (step, operation), with the count, total and max
+        seconds, mean milliseconds, tokens, cache hits and errors, slowest first.
+    """
+    with _timings_lock:
+        rows = [dict(timing, step=step, operation=name,
+                     mean_ms=1000.0 * timing["total_s"] / timing["count"])
+                for (step, name), timing in _timings.items()]
+    return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+
+def format_timing_table(rows=None):
+    """
+    Format the timing table as a Markdown table.
+
+    Args:
+        rows (list): Rows of timing_table(), all of them by default.
+
+    Returns:
+        str: The table.
+    """
+    rows = timing_table() if rows is None else rows
+    lines = ["| step | operation | count | total (s) | mean (ms) | max (s) | tokens | cache hits |",
+             "|:--|:--|--:|--:|--:|--:|--:|--:|"]
+    for row in rows:
+        lines.append(f"| {row['step']} | {row['operation']} | {row['count']} | {row['total_s']:.3f} "
+                     f"| {row['mean_ms']:.1f} | {row['max_s']:.3f} | {row['tokens']} | {row['cache_hits']} |")
+    return "\n".join(lines)
+
+
+def instrument_autogen():
+    """
+    Wrap autogen's LLM calls, speaker selections and chats in spans.
+
+    OpenAIWrapper.create covers every completion of the agents, including
+    the ones GroupChatManager makes to select the next speaker. Nothing is
+    patched when tracing is disabled, and calling it again does nothing.
+    """
+    global _instrumented
+    if _instrumented or not TRACING_ENABLED:
+        return
+    _instrumented = True
+
+    from autogen import ConversableAgent, GroupChat, OpenAIWrapper
+
+    create = OpenAIWrapper.create
+
+    @functools.wraps(create)
+    def traced_create(self, **config):
+        agent = config.get("agent")
+        with span("llm chat.completions", **{"llm.agent": getattr(agent, "name", None)}) as current:
+            response = create(self, **config)
+            if current is not None:
+                current.set_attribute("llm.request.bytes", payload_size(config.get("messages") or []))
+                current.set_attribute("llm.response.bytes", sum(
+                    len(getattr(choice.message, "content", None) or "")
+                    for choice in getattr(response, "choices", None) or []))
+                record_usage(current, getattr(response, "usage", None))
+            return response
+
+    OpenAIWrapper.create = traced_create
+
+    select_speaker = GroupChat.select_speaker
+    a_select_speaker = GroupChat.a_select_speaker
+
+    @functools.wraps(select_speaker)
+    def traced_select_speaker(self, last_speaker, selector):
+        with span("speaker selection", **{"groupchat.method": _method_name(self.speaker_selection_method)}):
+            return select_speaker(self, last_speaker, selector)
+
+    @functools.wraps(a_select_speaker)
+    async def traced_a_select_speaker(self, last_speaker, selector):
+        with span("speaker selection", **{"groupchat.method": _method_name(self.speaker_selection_method)}):
+            return await a_select_speaker(self, last_speaker, selector)
+
+    GroupChat.select_speaker = traced_select_speaker
+    GroupChat.a_select_speaker = traced_a_select_speaker
+
+    a_initiate_chat = ConversableAgent.a_initiate_chat
+
+    @functools.wraps(a_initiate_chat)
+    async def traced_a_initiate_chat(self, recipient, *args, **kwargs):
+        with span(f"chat {self.name} -> {recipient.name}") as current:
+            result = await a_initiate_chat(self, recipient, *args, **kwargs)
+            if current is not None:
+                current.set_attribute("chat.messages", len(result.chat_history))
+            return result
+
+    ConversableAgent.a_initiate_chat = traced_a_initiate_chat
+
+
+def _method_name(method):
+    return getattr(method, "__name__", str(method))
+
+
+def record_usage(current, usage):
+    """Record the token usage of an LLM response on a span."""
+    if current is None or usage is None:
+        return
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        current.set_attribute(f"llm.usage.{key}", getattr(usage, key, None) or 0)
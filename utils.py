@@ -1,16 +1,32 @@
 from autogen import UserProxyAgent
-from openai import OpenAI
-import streamlit as st
+from autogen.io import IOStream
 import asyncio
+import contextvars
+import functools
+import inspect
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import date
 import yaml
-import os
+
+from compaction import compact_messages, SUMMARY_CONTEXT_TOKENS
+from caching import get_llm_cache, make_key
+from clients import get_openai_client, get_async_openai_client, timed
+from tracing import span, current_span, payload_size, record_usage
 
 with open('conf/tasks_config.yml', 'r') as file:
     tasks_config = yaml.safe_load(file)
 with open('conf/agents_config.yml', 'r') as file:
     agents_config = yaml.safe_load(file)
 
+# Color codes autogen adds to its console output
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+# Long-lived event loop shared by every plan running in this process
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
 def process_task(task_name, **kwargs):
     """
     Process a task by rendering its template with provided keyword arguments.
@@ -62,7 +78,7 @@ def render_task(task_name, user_input_dictionary):
     input_dictionary = {}
     for key_input in task_content['inputs']:
         input_dictionary[key_input] = user_input_dictionary[key_input]
-        
+
     return process_task(task_name, **input_dictionary)
 
 def render_agent_sys_msg(agent_name):
@@ -100,6 +116,46 @@ def get_task_objective(task_name):
     else:
         raise ValueError(f"The task '{task_name}' does not have an objective")
         
+def build_summary_prompt(conversation_history, task_objective, model="gpt-4",
+                         max_tokens=SUMMARY_CONTEXT_TOKENS, on_compaction=None):
+    """
+    Build the prompt used to summarize a conversation against a task objective.
+
+    The conversation is compacted to max_tokens first (see
+    compaction.compact_messages), so the prompt size does not grow with the
+    length of the conversation.
+
+    Parameters:
+        conversation_history (list): List of conversation messages.
+        task_objective (str): The desired task objective to be achieved.
+        model (str): The model whose tokenizer measures the budget.
+        max_tokens (int): Token budget of the conversation history.
+        on_compaction (callable): If given, called with the compaction report
+            (tokens before, after and saved, duplicate and omitted messages).
+
+    Returns:
+        str: The summary prompt.
+    """
+    texts, report = compact_messages(conversation_history, max_tokens, model)
+    summary_span = current_span()
+    if summary_span is not None:
+        summary_span.set_attribute("summary.tokens", report["tokens_after"])
+        summary_span.set_attribute("summary.tokens_saved", report["tokens_saved"])
+        summary_span.set_attribute("summary.duplicates", report["duplicates"])
+        summary_span.set_attribute("summary.omitted", report["omitted"])
+    if on_compaction is not None:
+        on_compaction(report)
+
+    # Construct the prompt with conversation history and task objective
+    parts = ["""Given the following conversation history, please reflect 
+    on the task objective and produce an output that achieves it. 
+    The output must be as detailed as possible, not leaving behind 
+    important information, nor adding new information:\n\n"""]
+    parts.extend(f"User: {text}\n" for text in texts)
+    parts.append(f"""\nTask Objective: {task_objective}\n\nPlease provide the 
+    final output below:\n""")
+    return "".join(parts)
+
 def generate_summary_with_llm(conversation_history, task_objective, model="gpt-4"):
     """
     Uses a LLM to reflect on the conversation history and produce an 
@@ -113,35 +169,161 @@ def generate_summary_with_llm(conversation_history, task_objective, model="gpt-4
     Returns:
         str: The LLM-generated output that satisfies the task objective.
     """
-    # Construct the prompt with conversation history and task objective
-    prompt = """Given the following conversation history, please reflect 
-    on the task objective and produce an output that achieves it. 
-    The output must be as detailed as possible, not leaving behind 
-    important information, nor adding new information:\n\n"""
-    
-    for message in conversation_history:
-        prompt += f"User: {message['content']}\n"
+    with span("llm summary") as current:
+        prompt = build_summary_prompt(conversation_history, task_objective, model)
+        messages = [{"role": "user", "content": prompt}]
+        if current is not None:
+            current.set_attribute("llm.request.bytes", len(prompt))
+
+        # Identical conversations and objectives give identical outputs at temperature 0
+        cache = get_llm_cache()
+        key = make_key(model, messages, None, 0)
+        final_output = cache.get(key)
+        if final_output is not None:
+            return final_output
+
+        client = get_openai_client()
+        # Call the LLM (GPT-4 or other model)
+        with timed("openai chat.completions"):
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=2000,
+                temperature=0,
+            )
+            record_usage(current, response.usage)
+
+        # Extract the content from the LLM response
+        final_output = response.choices[0].message.content
+        cache.set(key, final_output)
+
+        return final_output
+
+async def a_generate_summary_with_llm(conversation_history, task_objective, model="gpt-4",
+                                     on_token=None, on_compaction=None):
+    """
+    (async) Uses a LLM to reflect on the conversation history and produce an
+    output that achieves the task objective.
 
-    prompt += f"""\nTask Objective: {task_objective}\n\nPlease provide the 
-    final output below:\n"""
+    Parameters:
+        conversation_history (list): List of conversation messages.
+        task_objective (str): The desired task objective to be achieved.
+        model (str): The LLM model to be used (e.g., "gpt-4").
+        on_token (callable): If given, the output is streamed and this function
+            is called with each new piece of text.
+        on_compaction (callable): If given, called with the compaction report
+            of the conversation (see build_summary_prompt).
 
-    client = OpenAI(
-        # defaults to os.environ.get("OPENAI_API_KEY")
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL")
-    )
-    # Call the LLM (GPT-4 or other model)
-    response = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=2000,
-        temperature=0,
-    )
+    Returns:
+        str: The LLM-generated output that satisfies the task objective.
+    """
+    with span("llm summary") as current:
+        prompt = build_summary_prompt(conversation_history, task_objective, model,
+                                      on_compaction=on_compaction)
+        messages = [{"role": "user", "content": prompt}]
+        if current is not None:
+            current.set_attribute("llm.request.bytes", len(prompt))
+
+        cache = get_llm_cache()
+        key = make_key(model, messages, None, 0)
+        final_output = cache.get(key)
+        if final_output is not None:
+            if on_token is not None:
+                on_token(final_output)
+            return final_output
+
+        client = get_async_openai_client()
+        # Call the LLM (GPT-4 or other model)
+        with timed("openai chat.completions"):
+            # Streamed responses report their usage in a last chunk without choices
+            stream_options = {"stream_options": {"include_usage": True}} if on_token is not None else {}
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=2000,
+                temperature=0,
+                stream=on_token is not None,
+                **stream_options,
+            )
+            if on_token is None:
+                # Extract the content from the LLM response
+                final_output = response.choices[0].message.content
+                record_usage(current, response.usage)
+            else:
+                parts = []
+                async for chunk in response:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_token(delta)
+                    if chunk.usage is not None:
+                        record_usage(current, chunk.usage)
+                final_output = "".join(parts)
+            if current is not None:
+                current.set_attribute("llm.response.bytes", len(final_output or ""))
+
+        cache.set(key, final_output)
+
+        return final_output
+
+class ChainOutputStream:
+    """
+    autogen IOStream collecting the output of one task chain, so that the page
+    can render it while the chain is still running.
 
-    # Extract the content from the LLM response
-    final_output = response.choices[0].message.content
-    
-    return final_output
+    Agent messages (and their tokens, when the llm_config streams) go to
+    `transcript`, which only keeps its last `max_chars` characters; the chain
+    summary goes to `summary`, and the compaction report of its prompt to
+    `compaction`.
+    """
+
+    def __init__(self, max_chars=20000):
+        self._lock = threading.Lock()
+        self.max_chars = max_chars
+        self.transcript = ""
+        self.summary = ""
+        self.compaction = None
+
+    def print(self, *objects, sep=" ", end="\n", flush=False):
+        text = ANSI_ESCAPE.sub("", sep.join(map(str, objects)) + end)
+        with self._lock:
+            self.transcript = (self.transcript + text)[-self.max_chars:]
+
+    def input(self, prompt="", *, password=False):
+        # Agents run with human_input_mode="NEVER"
+        return ""
+
+    def write_summary(self, text):
+        with self._lock:
+            self.summary += text
+
+    def write_compaction(self, report):
+        self.compaction = report
+
+def to_async_tool(func):
+    """
+    Wrap a tool so that it runs in a span, and in a worker thread when it is
+    blocking, when called by an async chat.
+
+    Args:
+        func (callable): The tool function.
+
+    Returns:
+        callable: A coroutine function with the same signature.
+    """
+    @functools.wraps(func)
+    async def _async_tool(*args, **kwargs):
+        with span(f"tool {func.__name__}",
+                  **{"tool.args.bytes": payload_size([args, kwargs])}) as current:
+            if inspect.iscoroutinefunction(func):
+                result = await func(*args, **kwargs)
+            else:
+                result = await asyncio.to_thread(func, *args, **kwargs)
+            if current is not None:
+                current.set_attribute("tool.result.bytes", payload_size(result))
+            return result
+
+    return _async_tool
 
 def create_agent(agent_class, name, system_message, llm_config, tools, termination_check):
     """
@@ -191,48 +373,153 @@ def create_user_proxy_agent(name, llm_config, tools, termination_check):
     )
     for tool_name, tool_dict in tools.items():
         key = list(tool_dict.keys())[0]
-        user_proxy.register_for_execution(name=tool_name)(key)
+        user_proxy.register_for_execution(name=tool_name)(to_async_tool(key))
     return user_proxy
 
-def generate_sequence_of_tasks(
-                               spinner_message, 
-                               user_agent,
-                               chats_list, 
-                               manager_agent, 
-                               critic_messages,
-                               objective
-                               ):
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor running each call in a copy of the submitter's
+    context, so context variables (e.g. the current span) reach the worker
+    thread as they do with asyncio.to_thread.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def get_event_loop():
+    """
+    Return the long-lived event loop of this process, starting it on first use.
+
+    The loop runs in a daemon thread, so plans from every session are
+    multiplexed on it instead of holding one thread each.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running event loop.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            # autogen runs blocking LLM calls in the default executor
+            _event_loop.set_default_executor(ContextThreadPoolExecutor(thread_name_prefix="planner-executor"))
+            threading.Thread(target=_event_loop.run_forever,
+                             name="planner-event-loop", daemon=True).start()
+    return _event_loop
+
+def submit_coroutine(coroutine):
+    """
+    Schedule a coroutine on the shared event loop.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        concurrent.futures.Future: A future holding the coroutine result.
     """
-    Generate a sequence of tasks involving chat initiation and summary generation.
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+async def a_run_sequence_of_tasks(user_agent,
+                                  chats_list,
+                                  manager_agent,
+                                  critic_messages,
+                                  objective,
+                                  output_stream=None):
+    """
+    (async) Run a sequence of chats and summarize the critic messages.
 
     Args:
-        spinner_message (str): Message to display while tasks are running.
         user_agent: The user agent instance to initiate chats.
-        chats_list (list): List of chats to initiate.
+        chats_list (list): List of chats to initiate, run one after another.
+            autogen runs "reflection_with_llm" summaries synchronously, which
+            would block the shared event loop: chats summarize with "last_msg".
         manager_agent: The manager agent instance to manage chat messages.
-        critic_messages (list): List of critic messages to summarize.
+        critic_messages (collections.deque): Critic messages to summarize.
         objective (str): The objective for the summary generation.
+        output_stream (ChainOutputStream): If given, receives the agents' output
+            and the streamed summary instead of the console.
 
     Returns:
         tuple: A tuple containing the summary of critic messages and the results of chat initiation.
+
+    Raises:
+        ValueError: If a chat summarizes with "reflection_with_llm".
     """
-    # Create an event loop: this is needed to run asynchronous functions
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    with st.spinner(spinner_message):
-        
-        async def initiate_chat():
-            chat_results = user_agent.initiate_chats(chats_list)
-            chat_messages = manager_agent.chat_messages[user_agent]
-            return chat_results, chat_messages
-        
-        results = loop.run_until_complete(initiate_chat())
-        loop.close()
-        
-        message_task = generate_summary_with_llm(critic_messages, objective)
-        
-    return message_task, results
+    if any(chat.get("summary_method") == "reflection_with_llm" for chat in chats_list):
+        raise ValueError("Chats of a sequence must summarize with 'last_msg'; "
+                         "the step summary comes from a_generate_summary_with_llm.")
+    # Each chat waits for all previous ones, as initiate_chats does
+    chat_queue = [dict(chat, chat_id=index, prerequisites=list(range(index)))
+                  for index, chat in enumerate(chats_list)]
+    if output_stream is None:
+        finished_chats = await user_agent.a_initiate_chats(chat_queue)
+    else:
+        with IOStream.set_default(output_stream):
+            finished_chats = await user_agent.a_initiate_chats(chat_queue)
+    chat_results = [finished_chats[index] for index in sorted(finished_chats)]
+    chat_messages = manager_agent.chat_messages[user_agent]
+
+    message_task = await a_generate_summary_with_llm(
+        critic_messages, objective,
+        on_token=output_stream.write_summary if output_stream is not None else None,
+        on_compaction=output_stream.write_compaction if output_stream is not None else None)
+
+    return message_task, (chat_results, chat_messages)
+
+def run_task_chains_concurrently(chains, return_exceptions=False):
+    """
+    Run independent task chains at the same time, yielding each one as it completes.
+
+    Every chain must own its agents and critic messages: chains are
+    interleaved on the shared event loop and must not share GroupChat state.
+
+    Args:
+        chains (dict): Mapping of chain name to the keyword arguments of
+            a_run_sequence_of_tasks, or of the coroutine function given as the
+            chain's "runner" (e.g. planner.a_run_hotels_direct).
+        return_exceptions (bool): Whether a failed chain is yielded as
+            (chain name, None, exception) while the other chains go on,
+            instead of raising.
+
+    Yields:
+        tuple: (chain name, summary of critic messages, results of chat initiation),
+        in completion order.
+
+    If a chain fails without return_exceptions, or the generator is closed
+    early, the chains still running are cancelled and waited for before the
+    error propagates, so their agents can be torn down safely afterwards.
+    """
+    tasks = []
+
+    async def run_step(name, runner, arguments):
+        tasks.append(asyncio.current_task())
+        with span(f"step {name}"):
+            return await runner(**arguments)
+
+    async def cancel_steps():
+        # Every step has started: the loop runs callbacks in submission order
+        running = [task for task in tasks if not task.done()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    futures = {}
+    for name, chain in chains.items():
+        runner = chain.get("runner", a_run_sequence_of_tasks)
+        arguments = {key: value for key, value in chain.items() if key != "runner"}
+        futures[submit_coroutine(run_step(name, runner, arguments))] = name
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if return_exceptions and future.exception() is not None:
+                    yield futures[future], None, future.exception()
+                    continue
+                message_task, results = future.result()
+                yield futures[future], message_task, results
+    finally:
+        if pending:
+            submit_coroutine(cancel_steps()).result()
 
 def hotels_colormap():
     """
@@ -0,0 +1,331 @@
+"""
+Warm cache of the places and dining steps of popular destinations.
+
+Must-see places and dining research barely change from one day to the
+next, so they are pre-computed for the destinations of conf/warm_cache.yml
+and served by the app without running the agents. Places are warmed per
+destination: a trip with other considerations gets the warm places adapted
+to them by a single summary call (see tailored_chain). Entries expire after
+WARM_CACHE_TTL_SECONDS and are versioned by the task templates and agent
+messages of their step: a stale or outdated entry is a miss, and the step
+runs live.
+
+Usage (e.g. daily from cron):
+    python warm_cache.py --workers 2
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+
+import yaml
+
+from airports import get_airport_index
+from caching import SQLiteCache, make_key
+from planner import build_llm_config, build_places_chain, build_dining_chain, teardown_chain
+from utils import (tasks_config, agents_config, run_task_chains_concurrently, render_task,
+                   a_generate_summary_with_llm)
+
+WARM_CACHE_ENABLED = os.getenv("WARM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+WARM_CACHE_PATH = os.getenv("WARM_CACHE_PATH", ".cache/warm_cache.sqlite")
+WARM_CACHE_TTL_SECONDS = float(os.getenv("WARM_CACHE_TTL_SECONDS", 2 * 24 * 3600))
+WARM_CACHE_CONFIG = "conf/warm_cache.yml"
+# Bumped when the layout of the entries changes
+WARM_CACHE_SCHEMA = 2
+
+# Tasks and agents whose configuration makes the version of a step's entries
+WARM_STEPS = {"places": {"tasks": ("search_places", "generate_table_places"),
+                         "build_chain": build_places_chain},
+              "dining": {"tasks": ("search_dining_places", "generate_dining_places_text"),
+                         "build_chain": build_dining_chain}}
+WEBSEARCH_AGENTS = ("websearch_assistant", "websearch_critic")
+
+
+@lru_cache(maxsize=None)
+def step_version(step):
+    """
+    Return the version of the warm entries of a step.
+
+    Args:
+        step (str): "places" or "dining".
+
+    Returns:
+        str: A digest of the step's task templates and agent configuration.
+    """
+    return make_key(WARM_CACHE_SCHEMA,
+                    [tasks_config[task_name] for task_name in WARM_STEPS[step]["tasks"]],
+                    [agents_config[agent_name] for agent_name in WEBSEARCH_AGENTS])[:12]
+
+
+def warm_key(step, trip):
+    """
+    Return the key of the warm entry of a step for a trip.
+
+    Places depend on the destination only (the considerations are applied
+    when serving, see tailored_chain); dining also depends on the selected
+    dining options, in any order.
+
+    Args:
+        step (str): "places" or "dining".
+        trip (dict): The trip details.
+
+    Returns:
+        str: The entry key.
+    """
+    inputs = [trip["country_option"].upper(), trip["city_name"].upper()]
+    if step == "dining":
+        inputs.append(sorted(trip["dining_options"]))
+    return make_key("warm", step, step_version(step), inputs)
+
+
+class WarmCache:
+    """
+    Versioned store of the step results of popular destinations.
+
+    Args:
+        store (SQLiteCache): Persistent store of the entries, expiring them.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, step, trip):
+        """
+        Return the fresh warm entry of a step for a trip.
+
+        Args:
+            step (str): "places" or "dining".
+            trip (dict): The trip details.
+
+        Returns:
+            dict: The entry (message, considerations, version, created_at), or None on a miss.
+        """
+        return self.store.get(warm_key(step, trip))
+
+    def set(self, step, trip, message):
+        """
+        Store the result of a step for a trip.
+
+        Args:
+            step (str): "places" or "dining".
+            trip (dict): The trip details the step ran with.
+            message (str): The text of the step.
+        """
+        self.store.set(warm_key(step, trip), {"message": message,
+                                              "considerations": trip["additional_considerations"],
+                                              "version": step_version(step),
+                                              "created_at": time.time()})
+
+    def lookup(self, trip):
+        """
+        Return the warm entries of the steps of a trip.
+
+        Args:
+            trip (dict): The trip details collected from the form.
+
+        Returns:
+            dict: Mapping of step name to its entry, for the steps with a fresh entry.
+        """
+        entries = {}
+        for step in WARM_STEPS:
+            entry = self.get(step, trip)
+            if entry is not None:
+                entries[step] = entry
+        return entries
+
+    def stats(self):
+        return self.store.stats()
+
+
+@lru_cache(maxsize=None)
+def get_warm_cache():
+    """
+    Return the process-wide warm cache.
+
+    Returns:
+        WarmCache: The shared warm cache, persisting to WARM_CACHE_PATH.
+    """
+    return WarmCache(SQLiteCache(WARM_CACHE_PATH, ttl=WARM_CACHE_TTL_SECONDS))
+
+
+def normalize_considerations(text):
+    """Return considerations lowercased and with their whitespace collapsed."""
+    return " ".join((text or "").lower().split())
+
+
+def tailored_chain(step, entry, trip):
+    """
+    Return the chain adapting a warm entry to the considerations of a trip.
+
+    Args:
+        step (str): "places" or "dining".
+        entry (dict): The warm entry of the step, as returned by WarmCache.get.
+        trip (dict): The trip details collected from the form.
+
+    Returns:
+        dict: The task chain (see utils.run_task_chains_concurrently), or None
+        when the entry serves the trip as it is: dining, no considerations or
+        the considerations the entry was warmed with.
+    """
+    considerations = normalize_considerations(trip["additional_considerations"])
+    if step != "places" or considerations in ("", normalize_considerations(entry["considerations"])):
+        return None
+    return {"runner": a_apply_considerations,
+            "message": entry["message"],
+            "considerations": trip["additional_considerations"]}
+
+
+async def a_apply_considerations(message, considerations, output_stream=None):
+    """
+    (async) Adapt the text of a warm entry to the considerations of a trip.
+
+    Args:
+        message (str): The text of the warm entry.
+        considerations (str): The additional considerations of the trip.
+        output_stream (ChainOutputStream): If given, receives the streamed text.
+
+    Returns:
+        tuple: The adapted text and None, as returned by the other chains.
+    """
+    objective = render_task('tailor_places', {'additional_considerations': considerations})
+    message_task = await a_generate_summary_with_llm(
+        [message], objective,
+        on_token=output_stream.write_summary if output_stream is not None else None,
+        on_compaction=output_stream.write_compaction if output_stream is not None else None)
+    return message_task, None
+
+
+def load_warm_config(path=WARM_CACHE_CONFIG):
+    """
+    Load the warm-up configuration.
+
+    Args:
+        path (str): The YAML file.
+
+    Returns:
+        dict: The destinations, places considerations and dining option selections.
+    """
+    with open(path, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def warm_destinations(config):
+    """
+    Return the trips warming the destinations of the configuration.
+
+    Destinations missing from the airports database are skipped, as the
+    app cannot select them.
+
+    Args:
+        config (dict): The warm-up configuration.
+
+    Returns:
+        list: One trip per destination, with the warmed places considerations.
+    """
+    airport_index = get_airport_index()
+    trips = []
+    for destination in config["destinations"]:
+        country, city = destination["country"].upper(), destination["city"].upper()
+        if city not in airport_index.cities_in_country(country):
+            print(f"Skipping {city}, {country}: not in the airports database")
+            continue
+        trips.append({"country_option": country,
+                      "city_name": city,
+                      "additional_considerations": config["places_considerations"],
+                      "dining_options": []})
+    return trips
+
+
+def warm_destination(warm_cache, trip, dining_option_sets, llm_config, force=False):
+    """
+    Run the places and dining steps of a destination missing from the warm cache.
+
+    Args:
+        warm_cache (WarmCache): The cache receiving the results.
+        trip (dict): The destination, as returned by warm_destinations.
+        dining_option_sets (list): The dining option selections to warm.
+        llm_config (dict): Configuration for the LLM.
+        force (bool): Whether fresh entries are computed again.
+
+    Returns:
+        int: The number of entries written.
+    """
+    targets = {"places": ("places", trip)}
+    for dining_options in dining_option_sets:
+        dining_trip = dict(trip, dining_options=list(dining_options))
+        targets["dining " + ", ".join(dining_options)] = ("dining", dining_trip)
+    if not force:
+        targets = {name: (step, step_trip) for name, (step, step_trip) in targets.items()
+                   if warm_cache.get(step, step_trip) is None}
+
+    chains = {}
+    written = 0
+    try:
+        for name, (step, step_trip) in targets.items():
+            chains[name] = WARM_STEPS[step]["build_chain"](step_trip, llm_config)
+        # Closed before the teardown, so failed runs cancel the other chains first
+        with closing(run_task_chains_concurrently(chains)) as completed_chains:
+            for name, message_task, _ in completed_chains:
+                if message_task:
+                    step, step_trip = targets[name]
+                    warm_cache.set(step, step_trip, message_task)
+                    written += 1
+    finally:
+        for chain in chains.values():
+            teardown_chain(chain)
+    return written
+
+
+def warm_up(config, llm_config, warm_cache=None, workers=2, force=False):
+    """
+    Warm the places and dining steps of every destination of the configuration.
+
+    Args:
+        config (dict): The warm-up configuration.
+        llm_config (dict): Configuration for the LLM.
+        warm_cache (WarmCache): The cache receiving the results, the shared one by default.
+        workers (int): Number of destinations warmed at the same time.
+        force (bool): Whether fresh entries are computed again.
+
+    Returns:
+        dict: Number of destinations, entries written and failed destinations.
+    """
+    warm_cache = warm_cache or get_warm_cache()
+    trips = warm_destinations(config)
+
+    def warm(trip):
+        try:
+            written = warm_destination(warm_cache, trip, config["dining_options"], llm_config, force)
+        except Exception as error:
+            print(f"{trip['city_name']}, {trip['country_option']}: failed ({type(error).__name__}: {error})")
+            return None
+        print(f"{trip['city_name']}, {trip['country_option']}: {written} entries warmed", flush=True)
+        return written
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warm-worker") as executor:
+        results = list(executor.map(warm, trips))
+    return {"destinations": len(trips),
+            "entries": sum(result for result in results if result is not None),
+            "failed": sum(result is None for result in results)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", default=WARM_CACHE_CONFIG, help="Warm-up configuration (YAML).")
+    parser.add_argument("--workers", type=int, default=2, help="Destinations warmed at the same time.")
+    parser.add_argument("--force", action="store_true", help="Compute fresh entries again.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    report = warm_up(load_warm_config(args.config), build_llm_config(stream=False),
+                     workers=args.workers, force=args.force)
+    print(f"{report['entries']} entries warmed for {report['destinations']} destinations "
+          f"in {time.perf_counter() - start:.1f} s, {report['failed']} failed")
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()